@@ -0,0 +1,738 @@
+import engine
+from engine import (
+    ALL_CASTLE_RIGHTS,
+    BKS,
+    BQS,
+    CASTLE_KEEP,
+    MATERIAL_SCORES,
+    MOVE_CASTLE,
+    MOVE_EN_PASSANT,
+    MOVE_PROMOTION,
+    POSITION_SCORES,
+    SEE_VALUES,
+    SNAPSHOT_MAX_HISTORY,
+    WKS,
+    WQS,
+    ZOBRIST_BLACK_TO_MOVE,
+    ZOBRIST_CASTLE,
+    ZOBRIST_EN_PASSANT,
+    ZOBRIST_PIECES,
+    Move,
+)
+
+"""Bitboard position core
+
+Square indices follow the board layout, so sq = row * 8 + col and bit sq is
+1 << sq. Row 0 is rank 8, exactly like GameState.board.
+"""
+
+SQUARES = [(sq >> 3, sq & 7) for sq in range(64)]
+PIECES = ("wp", "wN", "wB", "wR", "wQ", "wK", "bp", "bN", "bB", "bR", "bQ", "bK")
+
+FULL = 0xFFFFFFFFFFFFFFFF
+RANK_8 = 0xFF
+RANK_1 = 0xFF << 56
+# where a pawn lands after a single push that may go on to a double push
+WHITE_DOUBLE_PUSH = 0xFF << 40
+BLACK_DOUBLE_PUSH = 0xFF << 16
+NOT_FILE_A = FULL ^ 0x0101010101010101
+NOT_FILE_H = FULL ^ 0x8080808080808080
+# where the Zobrist key sits in the state tuples of BitboardGameState.undo_stack
+SAVED_KEY = 8
+# castling king's destination -> the rook's start and end squares
+CASTLE_ROOK_SQUARES = {62: (63, 61), 58: (56, 59), 6: (7, 5), 2: (0, 3)}
+EMPTY_BETWEEN_KS = {"w": (1 << 61) | (1 << 62), "b": (1 << 5) | (1 << 6)}
+EMPTY_BETWEEN_QS = {
+    "w": (1 << 57) | (1 << 58) | (1 << 59),
+    "b": (1 << 1) | (1 << 2) | (1 << 3),
+}
+
+
+def _build_leaper(deltas):
+    table = []
+    for row, col in SQUARES:
+        bb = 0
+        for dr, dc in deltas:
+            r, c = row + dr, col + dc
+            if 0 <= r < 8 and 0 <= c < 8:
+                bb |= 1 << (r * 8 + c)
+        table.append(bb)
+    return table
+
+
+def _build_rays(row, col, directions):
+    rays = []
+    for dr, dc in directions:
+        ray = []
+        r, c = row + dr, col + dc
+        while 0 <= r < 8 and 0 <= c < 8:
+            ray.append(1 << (r * 8 + c))
+            r += dr
+            c += dc
+        rays.append(ray)
+    return rays
+
+
+def _build_slider(directions):
+    """Attack sets for every relevant occupancy of every square.
+
+    The relevant mask leaves out the last square of each ray, since a piece
+    there cannot block anything further along.
+    """
+    masks = []
+    tables = []
+    for row, col in SQUARES:
+        rays = _build_rays(row, col, directions)
+        mask = 0
+        for ray in rays:
+            for bit in ray[:-1]:
+                mask |= bit
+
+        table = {}
+        sub = 0
+        while True:
+            attacks = 0
+            for ray in rays:
+                for bit in ray:
+                    attacks |= bit
+                    if sub & bit:
+                        break
+            table[sub] = attacks
+            sub = (sub - mask) & mask
+            if sub == 0:
+                break
+        masks.append(mask)
+        tables.append(table)
+    return masks, tables
+
+
+def _build_lines():
+    """Squares strictly between two aligned squares, 0 if they are not aligned"""
+    between = [[0] * 64 for _ in range(64)]
+    directions = ROOK_DIRECTIONS + BISHOP_DIRECTIONS
+    for sq, (row, col) in enumerate(SQUARES):
+        for ray in _build_rays(row, col, directions):
+            path = 0
+            for bit in ray:
+                between[sq][bit.bit_length() - 1] = path
+                path |= bit
+    return between
+
+
+KNIGHT_ATTACKS = _build_leaper(
+    ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
+)
+KING_ATTACKS = _build_leaper(
+    ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))
+)
+PAWN_ATTACKS = {
+    "w": _build_leaper(((-1, -1), (-1, 1))),
+    "b": _build_leaper(((1, -1), (1, 1))),
+}
+ROOK_DIRECTIONS = ((-1, 0), (1, 0), (0, -1), (0, 1))
+BISHOP_DIRECTIONS = ((-1, -1), (-1, 1), (1, -1), (1, 1))
+ROOK_MASKS, ROOK_TABLES = _build_slider(ROOK_DIRECTIONS)
+BISHOP_MASKS, BISHOP_TABLES = _build_slider(BISHOP_DIRECTIONS)
+BETWEEN = _build_lines()
+# every ray from a square in engine.QUEEN_RAYS order, so see breaks ties
+# between two sliders the way GameState.least_valuable_attacker does
+SEE_RAYS = [
+    [
+        sum(ray)
+        for ray in _build_rays(
+            row, col, engine.ROOK_DIRECTIONS + engine.BISHOP_DIRECTIONS
+        )
+    ]
+    for row, col in SQUARES
+]
+
+
+# Move instances are filled in directly, skipping Move.__init__'s board lookups
+new_move = Move.__new__
+
+
+def squares(bb):
+    """Yield the square index of every set bit, lowest first"""
+    while bb:
+        lsb = bb & -bb
+        yield lsb.bit_length() - 1
+        bb ^= lsb
+
+
+class BitboardGameState:
+    """Drop-in alternative to engine.GameState backed by 64-bit bitboards.
+
+    Pieces also sit in a flat 64-square mailbox, which gives moves their
+    piece strings; board is a row-by-row view of it for code written against
+    GameState. makeMove works on copies of the mailbox and bitboard dicts and
+    pushes the old ones, so undo_move just puts the saved state back.
+    """
+
+    def __init__(self):
+        self.board = [
+            ["bR", "bN", "bB", "bQ", "bK", "bB", "bN", "bR"],
+            ["bp", "bp", "bp", "bp", "bp", "bp", "bp", "bp"],
+            ["--", "--", "--", "--", "--", "--", "--", "--"],
+            ["--", "--", "--", "--", "--", "--", "--", "--"],
+            ["--", "--", "--", "--", "--", "--", "--", "--"],
+            ["--", "--", "--", "--", "--", "--", "--", "--"],
+            ["wp", "wp", "wp", "wp", "wp", "wp", "wp", "wp"],
+            ["wR", "wN", "wB", "wQ", "wK", "wB", "wN", "wR"],
+        ]
+        self.movelog = []
+        self.white_to_move = True
+        self.white_king = (7, 4)
+        self.black_king = (0, 4)
+        self.checkmate = False
+        self.stalemate = False
+        self.in_check = False
+        # pinned square -> line it may move along, and the checkers bitboard
+        self.pins = {}
+        self.checks = 0
+        self.en_passant_possible = ()
+        self.san_log = []
+
+        self.castle_bits = ALL_CASTLE_RIGHTS
+        self.halfmove_clock = 0
+        self.ply = 0
+        self.load_piece_squares()
+
+    @property
+    def board(self):
+        """The mailbox as 8 rows like GameState.board. It is a copy, so
+        writing to it does not change the position; assigning does."""
+        mailbox = self.mailbox
+        return [mailbox[sq : sq + 8] for sq in range(0, 64, 8)]
+
+    @board.setter
+    def board(self, rows):
+        self.mailbox = [piece for row in rows for piece in row]
+
+    def load_bitboards(self):
+        """Rebuild every bitboard and the evaluation sums from the mailbox"""
+        self.pieces = dict.fromkeys(PIECES, 0)
+        self.occupancy = {"w": 0, "b": 0}
+        self.material = 0
+        self.positional = 0
+        for sq, piece in enumerate(self.mailbox):
+            if piece != "--":
+                self.pieces[piece] |= 1 << sq
+                self.occupancy[piece[0]] |= 1 << sq
+                self.material += MATERIAL_SCORES[piece]
+                self.positional += POSITION_SCORES[piece][sq]
+                if piece == "wK":
+                    self.white_king = SQUARES[sq]
+                elif piece == "bK":
+                    self.black_king = SQUARES[sq]
+        self.occupied = self.occupancy["w"] | self.occupancy["b"]
+        self.zobrist_key = engine.zobrist_hash(
+            self.board,
+            self.white_to_move,
+            self.castle_bits,
+            self.en_passant_possible,
+        )
+
+    @property
+    def piece_squares(self):
+        """Square sets per piece, the same view GameState keeps incrementally"""
+        return {piece: set(squares(bb)) for piece, bb in self.pieces.items()}
+
+    def copy(self):
+        import copy
+
+        return copy.deepcopy(self)
+
+    current_castle_rights = engine.GameState.current_castle_rights
+    load_fen = engine.GameState.load_fen
+    get_valid_moves = engine.GameState.get_valid_moves
+    pick_moves = engine.GameState.pick_moves
+    legal_move = engine.GameState.legal_move
+    get_capture_moves = engine.GameState.get_capture_moves
+
+    def load_piece_squares(self):
+        """Rebuild from the mailbox and start the move history over, as
+        load_fen expects"""
+        self.load_bitboards()
+        # the state before each ply, see saved_state
+        self.undo_stack = []
+
+    def saved_state(self):
+        """Everything makeMove changes apart from the move log and side"""
+        return (
+            self.mailbox,
+            self.pieces,
+            self.occupancy,
+            self.occupied,
+            self.white_king,
+            self.black_king,
+            self.castle_bits,
+            self.en_passant_possible,
+            self.zobrist_key,
+            self.halfmove_clock,
+            self.material,
+            self.positional,
+        )
+
+    def key_history(self):
+        """Zobrist keys of every position so far, the current one last"""
+        return [state[SAVED_KEY] for state in self.undo_stack] + [self.zobrist_key]
+
+    def snapshot(self):
+        """The same tuple GameState.snapshot makes, so either class restores it"""
+        history = min(self.halfmove_clock, SNAPSHOT_MAX_HISTORY, self.ply)
+        keys = [state[SAVED_KEY] for state in self.undo_stack[self.ply - history :]]
+        keys.append(self.zobrist_key)
+        return (
+            tuple(map(tuple, self.board)),
+            self.white_to_move,
+            self.white_king,
+            self.black_king,
+            self.castle_bits,
+            self.en_passant_possible,
+            self.halfmove_clock,
+            tuple(keys),
+        )
+
+    def restore(self, snapshot):
+        """Reset to a snapshot, dropping the move log (it can't be undone past)"""
+        (
+            self.board,
+            self.white_to_move,
+            self.white_king,
+            self.black_king,
+            self.castle_bits,
+            self.en_passant_possible,
+            self.halfmove_clock,
+            keys,
+        ) = snapshot
+        self.load_bitboards()
+        self.zobrist_key = keys[-1]
+        self.movelog = []
+        self.san_log = []
+        self.checkmate = False
+        self.stalemate = False
+        self.in_check = False
+
+        # earlier plies keep only their key, enough for repetition checks
+        self.ply = len(keys) - 1
+        self.undo_stack = [(None,) * SAVED_KEY + (key,) for key in keys[:-1]]
+
+    def make_null_move(self):
+        """Pass the turn, for null-move pruning. undo_move takes it back and
+        the move log holds None for it meanwhile."""
+        self.undo_stack.append(self.saved_state())
+        self.ply += 1
+        self.halfmove_clock += 1
+        self.zobrist_key ^= ZOBRIST_BLACK_TO_MOVE
+        if self.en_passant_possible:
+            self.zobrist_key ^= ZOBRIST_EN_PASSANT[self.en_passant_possible[1]]
+            self.en_passant_possible = ()
+        self.movelog.append(None)
+        self.white_to_move = not self.white_to_move
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        gs = cls()
+        gs.restore(snapshot)
+        return gs
+
+    @classmethod
+    def from_fen(cls, fen):
+        gs = cls()
+        gs.load_fen(fen)
+        return gs
+
+    def makeMove(self, move):
+        packed = move.packed
+        piece = move.piece_moved
+        piece_cap = move.piece_cap
+        self.undo_stack.append(self.saved_state())
+        self.ply += 1
+        if piece_cap != "--" or piece[1] == "p":
+            self.halfmove_clock = 0
+        else:
+            self.halfmove_clock += 1
+
+        self.mailbox = mailbox = self.mailbox[:]
+        self.pieces = pieces = self.pieces.copy()
+        self.occupancy = occupancy = self.occupancy.copy()
+        ally = piece[0]
+        start_sq = packed & 63
+        end_sq = packed >> 6 & 63
+        from_to = 1 << start_sq | 1 << end_sq
+        occupied = self.occupied ^ 1 << start_sq | 1 << end_sq
+        key = self.zobrist_key ^ ZOBRIST_BLACK_TO_MOVE ^ ZOBRIST_PIECES[piece][start_sq]
+        positional = self.positional - POSITION_SCORES[piece][start_sq]
+        if self.en_passant_possible:
+            key ^= ZOBRIST_EN_PASSANT[self.en_passant_possible[1]]
+
+        if packed & MOVE_EN_PASSANT:
+            cap_sq = start_sq & 56 | end_sq & 7
+            cap_bit = 1 << cap_sq
+            key ^= ZOBRIST_PIECES[piece_cap][cap_sq]
+            pieces[piece_cap] ^= cap_bit
+            occupancy[piece_cap[0]] ^= cap_bit
+            occupied ^= cap_bit
+            mailbox[cap_sq] = "--"
+            self.material -= MATERIAL_SCORES[piece_cap]
+            positional -= POSITION_SCORES[piece_cap][cap_sq]
+        elif piece_cap != "--":
+            key ^= ZOBRIST_PIECES[piece_cap][end_sq]
+            pieces[piece_cap] ^= 1 << end_sq
+            occupancy[piece_cap[0]] ^= 1 << end_sq
+            self.material -= MATERIAL_SCORES[piece_cap]
+            positional -= POSITION_SCORES[piece_cap][end_sq]
+
+        mailbox[start_sq] = "--"
+        if packed & MOVE_PROMOTION:
+            placed = ally + "Q"
+            pieces[piece] ^= 1 << start_sq
+            pieces[placed] |= 1 << end_sq
+            self.material += MATERIAL_SCORES[placed] - MATERIAL_SCORES[piece]
+        else:
+            placed = piece
+            pieces[piece] ^= from_to
+        mailbox[end_sq] = placed
+        key ^= ZOBRIST_PIECES[placed][end_sq]
+        positional += POSITION_SCORES[placed][end_sq]
+        occupancy[ally] ^= from_to
+
+        if piece[1] == "K":
+            if ally == "w":
+                self.white_king = SQUARES[end_sq]
+            else:
+                self.black_king = SQUARES[end_sq]
+            if packed & MOVE_CASTLE:
+                rook_from, rook_to = CASTLE_ROOK_SQUARES[end_sq]
+                key ^= self._move_castle_rook(ally, rook_from, rook_to)
+                occupied ^= 1 << rook_from | 1 << rook_to
+                rook_scores = POSITION_SCORES[ally + "R"]
+                positional += rook_scores[rook_to] - rook_scores[rook_from]
+        if piece[1] == "p" and abs(start_sq - end_sq) == 16:
+            self.en_passant_possible = SQUARES[(start_sq + end_sq) >> 1]
+            key ^= ZOBRIST_EN_PASSANT[start_sq & 7]
+        else:
+            self.en_passant_possible = ()
+
+        self.occupied = occupied
+        self.movelog.append(move)
+        self.white_to_move = not self.white_to_move
+        castle_bits = self.castle_bits & CASTLE_KEEP[start_sq] & CASTLE_KEEP[end_sq]
+        if castle_bits != self.castle_bits:
+            key ^= ZOBRIST_CASTLE[self.castle_bits] ^ ZOBRIST_CASTLE[castle_bits]
+            self.castle_bits = castle_bits
+        self.zobrist_key = key
+        self.positional = positional
+
+    def undo_move(self):
+        if len(self.movelog) == 0:
+            return
+        self.movelog.pop()
+        self.ply -= 1
+        self.white_to_move = not self.white_to_move
+        (
+            self.mailbox,
+            self.pieces,
+            self.occupancy,
+            self.occupied,
+            self.white_king,
+            self.black_king,
+            self.castle_bits,
+            self.en_passant_possible,
+            self.zobrist_key,
+            self.halfmove_clock,
+            self.material,
+            self.positional,
+        ) = self.undo_stack.pop()
+
+    def _move_castle_rook(self, ally, rook_from, rook_to):
+        """Shift the castling rook and return its Zobrist delta"""
+        rook = ally + "R"
+        bits = 1 << rook_from | 1 << rook_to
+        self.pieces[rook] ^= bits
+        self.occupancy[ally] ^= bits
+        self.mailbox[rook_from] = "--"
+        self.mailbox[rook_to] = rook
+        keys = ZOBRIST_PIECES[rook]
+        return keys[rook_from] ^ keys[rook_to]
+
+    """Attack detection"""
+
+    def attackers_to(self, sq, colour, occ):
+        pieces = self.pieces
+        enemy = "b" if colour == "w" else "w"
+        rooks = pieces[colour + "R"] | pieces[colour + "Q"]
+        bishops = pieces[colour + "B"] | pieces[colour + "Q"]
+        return (
+            (KNIGHT_ATTACKS[sq] & pieces[colour + "N"])
+            | (KING_ATTACKS[sq] & pieces[colour + "K"])
+            | (PAWN_ATTACKS[enemy][sq] & pieces[colour + "p"])
+            | (ROOK_TABLES[sq][occ & ROOK_MASKS[sq]] & rooks)
+            | (BISHOP_TABLES[sq][occ & BISHOP_MASKS[sq]] & bishops)
+        )
+
+    def square_under_attack(self, row, col):
+        enemy = "b" if self.white_to_move else "w"
+        return self.attackers_to(row * 8 + col, enemy, self.occupied) != 0
+
+    def check_if_in_check(self):
+        king = self.white_king if self.white_to_move else self.black_king
+        return self.square_under_attack(king[0], king[1])
+
+    def see(self, move):
+        """Static exchange evaluation like GameState.see. Taking a capturer
+        out of occ lets the slider behind it join in."""
+        packed = move.packed
+        start_sq = packed & 63
+        sq = packed >> 6 & 63
+        occ = self.occupied ^ 1 << start_sq
+        on_square = move.piece_moved
+        if packed & MOVE_EN_PASSANT:
+            occ ^= 1 << (start_sq & 56 | sq & 7)
+            gain = [SEE_VALUES["p"]]
+        else:
+            gain = [SEE_VALUES.get(move.piece_cap[1], 0)]
+        if packed & MOVE_PROMOTION:
+            on_square = on_square[0] + "Q"
+            gain[0] += SEE_VALUES["Q"] - SEE_VALUES["p"]
+
+        colour = "b" if on_square[0] == "w" else "w"
+        while True:
+            attackers = self.attackers_to(sq, colour, occ) & occ
+            if not attackers:
+                break
+            for kind in "pNBRQK":
+                found = attackers & self.pieces[colour + kind]
+                if found:
+                    break
+            if found & found - 1 and kind in "BRQ":
+                for ray in SEE_RAYS[sq]:
+                    if found & ray:
+                        found &= ray
+                        break
+            gain.append(SEE_VALUES[on_square[1]] - gain[-1])
+            occ ^= found & -found
+            on_square = colour + kind
+            colour = "b" if colour == "w" else "w"
+
+        while len(gain) > 1:
+            last = gain.pop()
+            gain[-1] = -max(-gain[-1], last)
+        return gain[0]
+
+    def check_for_pins(self):
+        """(in check, pins, checkers) like GameState.check_for_pins, except
+        that pins maps each pinned square to the line it may still move
+        along and checkers is a bitboard"""
+        if self.white_to_move:
+            ally, enemy = "w", "b"
+        else:
+            ally, enemy = "b", "w"
+        king_sq = self.pieces[ally + "K"].bit_length() - 1
+        checkers = self.attackers_to(king_sq, enemy, self.occupied)
+        return checkers != 0, self.pinned_lines(king_sq, ally, enemy), checkers
+
+    def pinned_lines(self, king_sq, ally, enemy):
+        """Map each pinned ally square to the line it may still move along"""
+        pins = {}
+        pieces = self.pieces
+        occ_enemy = self.occupancy[enemy]
+        snipers = (
+            ROOK_TABLES[king_sq][0] & (pieces[enemy + "R"] | pieces[enemy + "Q"])
+        ) | (BISHOP_TABLES[king_sq][0] & (pieces[enemy + "B"] | pieces[enemy + "Q"]))
+        for sniper in squares(snipers):
+            path = BETWEEN[king_sq][sniper]
+            blockers = path & self.occupied
+            if blockers and blockers & (blockers - 1) == 0 and not blockers & occ_enemy:
+                pins[blockers.bit_length() - 1] = path | (1 << sniper)
+        return pins
+
+    """Generate valid moves with checks"""
+
+    def generate_moves(self, noisy=True, quiet=True, square=None):
+        """Legal moves for the pins and checks check_for_pins last found.
+
+        Noisy moves are captures and promotions, quiet moves everything else.
+        square limits generation to the piece standing on it.
+        """
+        moves = []
+        if self.white_to_move:
+            ally, enemy = "w", "b"
+        else:
+            ally, enemy = "b", "w"
+        pieces = self.pieces
+        occ = self.occupied
+        own = self.occupancy[ally]
+        wanted = 0
+        if noisy:
+            wanted = occ ^ own
+        if quiet:
+            wanted |= FULL ^ occ
+        from_mask = FULL if square is None else 1 << square
+        checkers = self.checks
+        pins = self.pins
+
+        king = pieces[ally + "K"]
+        king_sq = king.bit_length() - 1
+        if king & from_mask:
+            # the king may not step along a checking ray, so lift it off first
+            occ_no_king = occ ^ king
+            targets = KING_ATTACKS[king_sq] & wanted
+            while targets:
+                lsb = targets & -targets
+                targets ^= lsb
+                if not self.attackers_to(lsb.bit_length() - 1, enemy, occ_no_king):
+                    self._add_moves(moves, king_sq, lsb)
+            if quiet and not checkers:
+                self._castle_moves(ally, enemy, king_sq, moves)
+
+        if checkers & (checkers - 1):
+            return moves
+
+        if checkers:
+            target_mask = checkers | BETWEEN[king_sq][checkers.bit_length() - 1]
+            wanted &= target_mask
+        else:
+            target_mask = FULL
+
+        pawns = pieces[ally + "p"] & from_mask
+        if pawns:
+            # pinned pawns one at a time, each held to its own line
+            for sq, line in pins.items():
+                if pawns >> sq & 1:
+                    pawns ^= 1 << sq
+                    allowed = target_mask & line
+                    self._pawn_moves(ally, 1 << sq, allowed, noisy, quiet, moves)
+            if pawns:
+                self._pawn_moves(ally, pawns, target_mask, noisy, quiet, moves)
+        if noisy and self.en_passant_possible:
+            self._en_passant_moves(ally, enemy, king_sq, target_mask, from_mask, moves)
+
+        add_moves = self._add_moves
+        knights = pieces[ally + "N"] & from_mask
+        while knights:
+            lsb = knights & -knights
+            knights ^= lsb
+            sq = lsb.bit_length() - 1
+            if sq not in pins:
+                add_moves(moves, sq, KNIGHT_ATTACKS[sq] & wanted)
+
+        for piece, table, masks in (
+            ("B", BISHOP_TABLES, BISHOP_MASKS),
+            ("R", ROOK_TABLES, ROOK_MASKS),
+            ("Q", BISHOP_TABLES, BISHOP_MASKS),
+            ("Q", ROOK_TABLES, ROOK_MASKS),
+        ):
+            sliders = pieces[ally + piece] & from_mask
+            while sliders:
+                lsb = sliders & -sliders
+                sliders ^= lsb
+                sq = lsb.bit_length() - 1
+                targets = table[sq][occ & masks[sq]] & wanted
+                if sq in pins:
+                    targets &= pins[sq]
+                add_moves(moves, sq, targets)
+        return moves
+
+    def _add_moves(self, moves, sq, targets, flags=0):
+        """Append a move from sq to every square in targets"""
+        mailbox = self.mailbox
+        piece = mailbox[sq]
+        while targets:
+            lsb = targets & -targets
+            targets ^= lsb
+            to = lsb.bit_length() - 1
+            move = new_move(Move)
+            move.packed = sq | to << 6 | flags
+            move.piece_moved = piece
+            move.piece_cap = mailbox[to]
+            moves.append(move)
+
+    def _add_pawn_moves(self, moves, targets, back, flags=0):
+        """Append a move onto every square in targets from back squares
+        behind it, which is where the pawn came from"""
+        mailbox = self.mailbox
+        while targets:
+            lsb = targets & -targets
+            targets ^= lsb
+            to = lsb.bit_length() - 1
+            move = new_move(Move)
+            move.packed = to + back | to << 6 | flags
+            move.piece_moved = mailbox[to + back]
+            move.piece_cap = mailbox[to]
+            moves.append(move)
+
+    def _pawn_moves(self, ally, pawns, allowed, noisy, quiet, moves):
+        """Pushes and captures of a set of pawns, landing only on allowed"""
+        empty = FULL ^ self.occupied
+        enemy_occ = self.occupied ^ self.occupancy[ally]
+        if ally == "w":
+            one = pawns >> 8 & empty
+            two = (one & WHITE_DOUBLE_PUSH) >> 8 & empty & allowed
+            west = (pawns & NOT_FILE_A) >> 9 & enemy_occ & allowed
+            east = (pawns & NOT_FILE_H) >> 7 & enemy_occ & allowed
+            back, back_west, back_east, last_rank = 8, 9, 7, RANK_8
+        else:
+            one = pawns << 8 & empty
+            two = (one & BLACK_DOUBLE_PUSH) << 8 & empty & allowed
+            west = (pawns & NOT_FILE_A) << 7 & enemy_occ & allowed
+            east = (pawns & NOT_FILE_H) << 9 & enemy_occ & allowed
+            back, back_west, back_east, last_rank = -8, -7, -9, RANK_1
+        one &= allowed
+
+        add = self._add_pawn_moves
+        if quiet:
+            add(moves, one & ~last_rank, back)
+            add(moves, two, back * 2)
+        if noisy:
+            add(moves, one & last_rank, back, MOVE_PROMOTION)
+            add(moves, west & ~last_rank, back_west)
+            add(moves, west & last_rank, back_west, MOVE_PROMOTION)
+            add(moves, east & ~last_rank, back_east)
+            add(moves, east & last_rank, back_east, MOVE_PROMOTION)
+
+    def _en_passant_moves(self, ally, enemy, king_sq, target_mask, from_mask, moves):
+        ep_row, ep_col = self.en_passant_possible
+        ep_sq = ep_row * 8 + ep_col
+        cap_sq = ep_sq + (8 if ally == "w" else -8)
+        checkers = self.checks
+        # the double-pushed pawn may itself be the only checker
+        if checkers and not (checkers >> cap_sq & 1 or target_mask >> ep_sq & 1):
+            return
+        pawns = PAWN_ATTACKS[enemy][ep_sq] & self.pieces[ally + "p"] & from_mask
+        for sq in squares(pawns):
+            if sq in self.pins and not self.pins[sq] >> ep_sq & 1:
+                continue
+            # both pawns leave the rank at once, which can expose the king
+            occ = self.occupied ^ (1 << sq) ^ (1 << cap_sq) | (1 << ep_sq)
+            if self.attackers_to(king_sq, enemy, occ) & ~(1 << cap_sq):
+                continue
+            move = new_move(Move)
+            move.packed = sq | ep_sq << 6 | MOVE_EN_PASSANT
+            move.piece_moved = ally + "p"
+            move.piece_cap = enemy + "p"
+            moves.append(move)
+
+    def _castle_moves(self, ally, enemy, king_sq, moves):
+        if ally == "w":
+            king_side, queen_side = self.castle_bits & WKS, self.castle_bits & WQS
+        else:
+            king_side, queen_side = self.castle_bits & BKS, self.castle_bits & BQS
+        occ = self.occupied
+        rook = self.pieces[ally + "R"]
+        if (
+            king_side
+            and not occ & EMPTY_BETWEEN_KS[ally]
+            and rook >> (king_sq + 3) & 1
+            and not self.attackers_to(king_sq + 1, enemy, occ)
+            and not self.attackers_to(king_sq + 2, enemy, occ)
+        ):
+            self._add_moves(moves, king_sq, 1 << (king_sq + 2), MOVE_CASTLE)
+        if (
+            queen_side
+            and not occ & EMPTY_BETWEEN_QS[ally]
+            and rook >> (king_sq - 4) & 1
+            and not self.attackers_to(king_sq - 1, enemy, occ)
+            and not self.attackers_to(king_sq - 2, enemy, occ)
+        ):
+            self._add_moves(moves, king_sq, 1 << (king_sq - 2), MOVE_CASTLE)
@@ -1,3 +1,128 @@
+import os
+import random
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+"""Zobrist keys, seeded so every process hashes a position to the same key"""
+_zobrist_rng = random.Random(20240601)
+ZOBRIST_PIECES = {
+    colour + piece: [_zobrist_rng.getrandbits(64) for _ in range(64)]
+    for colour in "wb"
+    for piece in "pNBRQK"
+}
+ZOBRIST_BLACK_TO_MOVE = _zobrist_rng.getrandbits(64)
+ZOBRIST_CASTLE = [_zobrist_rng.getrandbits(64) for _ in range(16)]
+ZOBRIST_EN_PASSANT = [_zobrist_rng.getrandbits(64) for _ in range(8)]
+
+"""Castle rights packed into 4 bits"""
+WKS, BKS, WQS, BQS = 1, 2, 4, 8
+ALL_CASTLE_RIGHTS = WKS | BKS | WQS | BQS
+# rights still held after a move starts or ends on each square
+CASTLE_KEEP = [ALL_CASTLE_RIGHTS] * 64
+CASTLE_KEEP[0] = ALL_CASTLE_RIGHTS & ~BQS
+CASTLE_KEEP[4] = ALL_CASTLE_RIGHTS & ~(BKS | BQS)
+CASTLE_KEEP[7] = ALL_CASTLE_RIGHTS & ~BKS
+CASTLE_KEEP[56] = ALL_CASTLE_RIGHTS & ~WQS
+CASTLE_KEEP[60] = ALL_CASTLE_RIGHTS & ~(WKS | WQS)
+CASTLE_KEEP[63] = ALL_CASTLE_RIGHTS & ~WKS
+
+"""Move flags, stored above the 12 bits of from and to squares"""
+MOVE_EN_PASSANT = 1 << 12
+MOVE_CASTLE = 1 << 13
+MOVE_PROMOTION = 1 << 14
+
+"""Move tables indexed by square, built once at import"""
+ROOK_DIRECTIONS = ((-1, 0), (0, -1), (1, 0), (0, 1))
+BISHOP_DIRECTIONS = ((-1, -1), (-1, 1), (1, -1), (1, 1))
+KNIGHT_OFFSETS = (
+    (-2, -1),
+    (-2, 1),
+    (-1, -2),
+    (-1, 2),
+    (1, -2),
+    (1, 2),
+    (2, -1),
+    (2, 1),
+)
+KING_OFFSETS = ROOK_DIRECTIONS + BISHOP_DIRECTIONS
+
+
+def _build_targets(offsets):
+    """For every square, the (row, col) squares one offset away on the board"""
+    table = []
+    for sq in range(64):
+        row, col = sq >> 3, sq & 7
+        table.append(
+            tuple(
+                (row + dr, col + dc)
+                for dr, dc in offsets
+                if 0 <= row + dr < 8 and 0 <= col + dc < 8
+            )
+        )
+    return table
+
+
+def _build_rays(directions):
+    """For every square, a (direction, squares out to the edge) pair per direction"""
+    table = []
+    for sq in range(64):
+        row, col = sq >> 3, sq & 7
+        rays = []
+        for dr, dc in directions:
+            ray = []
+            r, c = row + dr, col + dc
+            while 0 <= r < 8 and 0 <= c < 8:
+                ray.append((r, c))
+                r += dr
+                c += dc
+            rays.append(((dr, dc), tuple(ray)))
+        table.append(tuple(rays))
+    return table
+
+
+KNIGHT_TARGETS = _build_targets(KNIGHT_OFFSETS)
+KING_TARGETS = _build_targets(KING_OFFSETS)
+ROOK_RAYS = _build_rays(ROOK_DIRECTIONS)
+BISHOP_RAYS = _build_rays(BISHOP_DIRECTIONS)
+# rook rays first, then bishop rays, as check_for_pins relies on
+QUEEN_RAYS = [ROOK_RAYS[sq] + BISHOP_RAYS[sq] for sq in range(64)]
+
+"""Undo stack layout: captured piece, castle bits, en passant square, key,
+halfmove clock, material, positional score"""
+UNDO_STRIDE = 7
+UNDO_INITIAL_PLIES = 256
+# keys older than this can't repeat under the fifty-move rule
+SNAPSHOT_MAX_HISTORY = 100
+
+# MVV-LVA: most valuable victim first, least valuable attacker breaking ties
+MVV_LVA_VALUES = {"p": 1, "N": 3, "B": 3, "R": 5, "Q": 9, "K": 0, "-": 0}
+# static exchange values, the king is only ever the last capturer
+SEE_VALUES = {"p": 100, "N": 300, "B": 300, "R": 500, "Q": 900, "K": 20000}
+
+"""Evaluation in centipawns from white's side, summed incrementally by makeMove"""
+PIECE_VALUES = {"p": 100, "N": 300, "B": 300, "R": 500, "Q": 900, "K": 0}
+_CENTRE_BONUS = [
+    20 if 2 <= sq >> 3 <= 5 and 2 <= sq & 7 <= 5 else 0 for sq in range(64)
+]
+# white's view with row 0 as rank 8, black reads them mirrored
+PIECE_SQUARE_TABLES = {
+    "p": _CENTRE_BONUS,
+    "N": _CENTRE_BONUS,
+    "B": _CENTRE_BONUS,
+    "R": [0] * 64,
+    "Q": [0] * 64,
+    "K": [0] * 64,
+}
+MATERIAL_SCORES = {}
+POSITION_SCORES = {}
+for _kind, _table in PIECE_SQUARE_TABLES.items():
+    MATERIAL_SCORES["w" + _kind] = PIECE_VALUES[_kind]
+    MATERIAL_SCORES["b" + _kind] = -PIECE_VALUES[_kind]
+    POSITION_SCORES["w" + _kind] = list(_table)
+    POSITION_SCORES["b" + _kind] = [-_table[sq ^ 56] for sq in range(64)]
+
+
 class GameState:
     def __init__(self):
         # the board is a 2d 8x8 list where '--' is a space
@@ -30,100 +155,345 @@ class GameState:
         self.checks = []
         self.en_passant_possible = ()
         self.san_log = []
+        # which kinds of move the per-piece generators emit, see generate_moves
+        self.gen_noisy = True
+        self.gen_quiet = True
+
+        self.load_piece_squares()
+        self.castle_bits = ALL_CASTLE_RIGHTS
+        self.halfmove_clock = 0
+        self.zobrist_key = zobrist_hash(
+            self.board,
+            self.white_to_move,
+            self.castle_bits,
+            self.en_passant_possible,
+        )
+        # one UNDO_STRIDE slot per ply, grown by doubling and never shrunk
+        self.undo_stack = [None] * (UNDO_STRIDE * UNDO_INITIAL_PLIES)
+        self.ply = 0
+
+    def load_piece_squares(self):
+        """Rebuild the per-piece square sets and evaluation sums from the board"""
+        self.piece_squares = {piece: set() for piece in ZOBRIST_PIECES}
+        self.material = 0
+        self.positional = 0
+        for row in range(8):
+            for col in range(8):
+                piece = self.board[row][col]
+                if piece != "--":
+                    self.piece_squares[piece].add(row * 8 + col)
+                    self.material += MATERIAL_SCORES[piece]
+                    self.positional += POSITION_SCORES[piece][row * 8 + col]
+
+    @property
+    def current_castle_rights(self):
+        bits = self.castle_bits
+        return CastleRights(
+            bits & WKS != 0, bits & BKS != 0, bits & WQS != 0, bits & BQS != 0
+        )
 
-        self.current_castle_rights = CastleRights(True, True, True, True)
-        self.castle_rights_log = [
-            CastleRights(
-                self.current_castle_rights.wks,
-                self.current_castle_rights.bks,
-                self.current_castle_rights.wqs,
-                self.current_castle_rights.bqs,
-            )
-        ]
+    def key_history(self):
+        """Zobrist keys of every position so far, the current one last"""
+        end = self.ply * UNDO_STRIDE
+        return self.undo_stack[3:end:UNDO_STRIDE] + [self.zobrist_key]
 
     def copy(self):
         import copy
 
         return copy.deepcopy(self)
 
+    def snapshot(self):
+        """Capture just the state search needs as a small picklable tuple.
+
+        Only keys since the last capture or pawn move are kept, capped at
+        SNAPSHOT_MAX_HISTORY, so the cost does not grow with the game.
+        """
+        history = min(self.halfmove_clock, SNAPSHOT_MAX_HISTORY, self.ply)
+        end = self.ply * UNDO_STRIDE
+        keys = self.undo_stack[end - history * UNDO_STRIDE + 3 : end : UNDO_STRIDE]
+        keys.append(self.zobrist_key)
+        return (
+            tuple(map(tuple, self.board)),
+            self.white_to_move,
+            self.white_king,
+            self.black_king,
+            self.castle_bits,
+            self.en_passant_possible,
+            self.halfmove_clock,
+            tuple(keys),
+        )
+
+    def restore(self, snapshot):
+        """Reset to a snapshot, dropping the move log (it can't be undone past)"""
+        (
+            board,
+            self.white_to_move,
+            self.white_king,
+            self.black_king,
+            self.castle_bits,
+            self.en_passant_possible,
+            self.halfmove_clock,
+            keys,
+        ) = snapshot
+        self.board = [list(row) for row in board]
+        self.load_piece_squares()
+        self.zobrist_key = keys[-1]
+        self.movelog = []
+        self.san_log = []
+        self.checkmate = False
+        self.stalemate = False
+        self.in_check = False
+
+        # earlier plies keep only their key, enough for repetition checks
+        self.ply = len(keys) - 1
+        stack = self.undo_stack
+        while len(stack) < (self.ply + 1) * UNDO_STRIDE:
+            stack.extend([None] * len(stack))
+        stack[3 : self.ply * UNDO_STRIDE : UNDO_STRIDE] = keys[:-1]
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        gs = cls()
+        gs.restore(snapshot)
+        return gs
+
+    def load_fen(self, fen):
+        """Set up the position from a FEN string, dropping the move log"""
+        fields = fen.split()
+        if len(fields) < 2:
+            raise ValueError(f"FEN needs at least placement and side: {fen!r}")
+        castling = fields[2] if len(fields) > 2 else "-"
+        en_passant = fields[3] if len(fields) > 3 else "-"
+
+        board = []
+        for rank in fields[0].split("/"):
+            row = []
+            for ch in rank:
+                if ch.isdigit():
+                    row.extend(["--"] * int(ch))
+                elif ch.upper() in "PNBRQK":
+                    kind = "p" if ch in "Pp" else ch.upper()
+                    row.append(("w" if ch.isupper() else "b") + kind)
+                else:
+                    raise ValueError(f"bad piece {ch!r} in FEN: {fen!r}")
+            board.append(row)
+        if len(board) != 8 or any(len(row) != 8 for row in board):
+            raise ValueError(f"FEN board is not 8x8: {fen!r}")
+
+        self.board = board
+        for row in range(8):
+            for col in range(8):
+                if board[row][col] == "wK":
+                    self.white_king = (row, col)
+                elif board[row][col] == "bK":
+                    self.black_king = (row, col)
+        self.white_to_move = fields[1] == "w"
+        self.castle_bits = CastleRights(
+            "K" in castling, "k" in castling, "Q" in castling, "q" in castling
+        ).bits()
+        self.en_passant_possible = ()
+        if en_passant != "-":
+            self.en_passant_possible = (
+                Move.ranksToRows[en_passant[1]],
+                Move.filesToCols[en_passant[0]],
+            )
+        self.halfmove_clock = int(fields[4]) if len(fields) > 4 else 0
+        self.zobrist_key = zobrist_hash(
+            self.board,
+            self.white_to_move,
+            self.castle_bits,
+            self.en_passant_possible,
+        )
+        self.load_piece_squares()
+        self.movelog = []
+        self.san_log = []
+        self.checkmate = False
+        self.stalemate = False
+        self.in_check = False
+        self.ply = 0
+
+    @classmethod
+    def from_fen(cls, fen):
+        gs = cls()
+        gs.load_fen(fen)
+        return gs
+
     def makeMove(self, move):
-        move.en_passant_possible = self.en_passant_possible
-        self.board[move.start_row][move.start_col] = "--"
-        self.board[move.end_row][move.end_col] = move.piece_moved
+        packed = move.packed
+        piece = move.piece_moved
+        piece_cap = move.piece_cap
+        stack = self.undo_stack
+        i = self.ply * UNDO_STRIDE
+        if i == len(stack):
+            stack.extend([None] * len(stack))
+        stack[i] = piece_cap
+        stack[i + 1] = self.castle_bits
+        stack[i + 2] = self.en_passant_possible
+        stack[i + 3] = self.zobrist_key
+        stack[i + 4] = self.halfmove_clock
+        stack[i + 5] = self.material
+        stack[i + 6] = self.positional
+        self.ply += 1
+        if piece_cap != "--" or piece[1] == "p":
+            self.halfmove_clock = 0
+        else:
+            self.halfmove_clock += 1
+
+        board = self.board
+        piece_squares = self.piece_squares
+        start_sq = packed & 63
+        end_sq = packed >> 6 & 63
+        start_row, start_col = start_sq >> 3, start_sq & 7
+        end_row, end_col = end_sq >> 3, end_sq & 7
+        key = self.zobrist_key ^ ZOBRIST_BLACK_TO_MOVE
+        key ^= ZOBRIST_PIECES[piece][start_sq]
+        positional = self.positional - POSITION_SCORES[piece][start_sq]
+        if packed & MOVE_EN_PASSANT:
+            key ^= ZOBRIST_PIECES[piece_cap][start_row * 8 + end_col]
+            board[start_row][end_col] = "--"
+            piece_squares[piece_cap].remove(start_row * 8 + end_col)
+            self.material -= MATERIAL_SCORES[piece_cap]
+            positional -= POSITION_SCORES[piece_cap][start_row * 8 + end_col]
+        elif piece_cap != "--":
+            key ^= ZOBRIST_PIECES[piece_cap][end_sq]
+            piece_squares[piece_cap].remove(end_sq)
+            self.material -= MATERIAL_SCORES[piece_cap]
+            positional -= POSITION_SCORES[piece_cap][end_sq]
+        if self.en_passant_possible:
+            key ^= ZOBRIST_EN_PASSANT[self.en_passant_possible[1]]
+
+        board[start_row][start_col] = "--"
+        piece_squares[piece].remove(start_sq)
+        if packed & MOVE_PROMOTION:
+            placed = piece[0] + "Q"
+            self.material += MATERIAL_SCORES[placed] - MATERIAL_SCORES[piece]
+        else:
+            placed = piece
+        board[end_row][end_col] = placed
+        piece_squares[placed].add(end_sq)
+        key ^= ZOBRIST_PIECES[placed][end_sq]
+        positional += POSITION_SCORES[placed][end_sq]
         self.movelog.append(move)
         self.white_to_move = not self.white_to_move
-        if move.piece_moved == "wK":
-            self.white_king = (move.end_row, move.end_col)
-        if move.piece_moved == "bK":
-            self.black_king = (move.end_row, move.end_col)
-        if move.is_pawn_promoted:
-            self.board[move.end_row][move.end_col] = move.piece_moved[0] + "Q"
-        if move.en_passant:
-            cap_row = move.start_row
-            cap_col = move.end_col
-            self.board[cap_row][cap_col] = "--"
-        if move.piece_moved[1] == "p" and abs(move.start_row - move.end_row) == 2:
-            self.en_passant_possible = (
-                (move.start_row + move.end_row) // 2,
-                move.start_col,
-            )
+        if piece == "wK":
+            self.white_king = (end_row, end_col)
+        elif piece == "bK":
+            self.black_king = (end_row, end_col)
+        if piece[1] == "p" and abs(start_row - end_row) == 2:
+            self.en_passant_possible = ((start_row + end_row) // 2, start_col)
+            key ^= ZOBRIST_EN_PASSANT[start_col]
         else:
             self.en_passant_possible = ()
 
-        self.update_castle_rights(move)
-        self.castle_rights_log.append(
-            CastleRights(
-                self.current_castle_rights.wks,
-                self.current_castle_rights.bks,
-                self.current_castle_rights.wqs,
-                self.current_castle_rights.bqs,
-            )
-        )
-        if move.can_castle:
-            if move.end_col - move.start_col == 2:
+        # a king or rook leaving home, or a rook captured there, loses rights
+        castle_bits = self.castle_bits & CASTLE_KEEP[start_sq] & CASTLE_KEEP[end_sq]
+        if castle_bits != self.castle_bits:
+            key ^= ZOBRIST_CASTLE[self.castle_bits] ^ ZOBRIST_CASTLE[castle_bits]
+            self.castle_bits = castle_bits
+        if packed & MOVE_CASTLE:
+            if end_col - start_col == 2:
                 rook_start_col = 7
-                rook_end_col = move.end_col - 1
+                rook_end_col = end_col - 1
             else:
                 rook_start_col = 0
-                rook_end_col = move.end_col + 1
-
-            self.board[move.end_row][rook_end_col] = self.board[move.end_row][
-                rook_start_col
-            ]
-            self.board[move.end_row][rook_start_col] = "--"
+                rook_end_col = end_col + 1
+
+            rook = board[end_row][rook_start_col]
+            board[end_row][rook_end_col] = rook
+            board[end_row][rook_start_col] = "--"
+            rook_squares = piece_squares[rook]
+            rook_squares.remove(end_row * 8 + rook_start_col)
+            rook_squares.add(end_row * 8 + rook_end_col)
+            rook_keys = ZOBRIST_PIECES[rook]
+            key ^= rook_keys[end_row * 8 + rook_start_col]
+            key ^= rook_keys[end_row * 8 + rook_end_col]
+            rook_scores = POSITION_SCORES[rook]
+            positional -= rook_scores[end_row * 8 + rook_start_col]
+            positional += rook_scores[end_row * 8 + rook_end_col]
+
+        self.zobrist_key = key
+        self.positional = positional
+
+    def make_null_move(self):
+        """Pass the turn, for null-move pruning. undo_move takes it back and
+        the move log holds None for it meanwhile."""
+        stack = self.undo_stack
+        i = self.ply * UNDO_STRIDE
+        if i == len(stack):
+            stack.extend([None] * len(stack))
+        stack[i] = "--"
+        stack[i + 1] = self.castle_bits
+        stack[i + 2] = self.en_passant_possible
+        stack[i + 3] = self.zobrist_key
+        stack[i + 4] = self.halfmove_clock
+        stack[i + 5] = self.material
+        stack[i + 6] = self.positional
+        self.ply += 1
+        self.halfmove_clock += 1
+
+        self.zobrist_key ^= ZOBRIST_BLACK_TO_MOVE
+        if self.en_passant_possible:
+            self.zobrist_key ^= ZOBRIST_EN_PASSANT[self.en_passant_possible[1]]
+            self.en_passant_possible = ()
+        self.movelog.append(None)
+        self.white_to_move = not self.white_to_move
 
     """Undo last move"""
 
     def undo_move(self):
         if len(self.movelog) != 0:
             move = self.movelog.pop()
-            self.white_to_move = not self.white_to_move
-            if move.piece_moved == "wK":
-                self.white_king = (move.start_row, move.start_col)
-            if move.piece_moved == "bK":
-                self.black_king = (move.start_row, move.start_col)
-
-            if move.en_passant:
-                self.board[move.start_row][move.start_col] = move.piece_moved
-                self.board[move.end_row][move.end_col] = "--"
-                self.board[move.start_row][move.end_col] = move.piece_cap
+            self.ply -= 1
+            i = self.ply * UNDO_STRIDE
+            stack = self.undo_stack
+            piece_cap = stack[i]
+            self.castle_bits = stack[i + 1]
+            self.en_passant_possible = stack[i + 2]
+            self.zobrist_key = stack[i + 3]
+            self.halfmove_clock = stack[i + 4]
+            self.material = stack[i + 5]
+            self.positional = stack[i + 6]
+            if move is None:
+                self.white_to_move = not self.white_to_move
+                return
 
+            board = self.board
+            packed = move.packed
+            piece = move.piece_moved
+            start_sq = packed & 63
+            end_sq = packed >> 6 & 63
+            start_row, start_col = start_sq >> 3, start_sq & 7
+            end_row, end_col = end_sq >> 3, end_sq & 7
+            self.white_to_move = not self.white_to_move
+            if piece == "wK":
+                self.white_king = (start_row, start_col)
+            elif piece == "bK":
+                self.black_king = (start_row, start_col)
+
+            piece_squares = self.piece_squares
+            piece_squares[board[end_row][end_col]].remove(end_sq)
+            piece_squares[piece].add(start_sq)
+            board[start_row][start_col] = piece
+            if packed & MOVE_EN_PASSANT:
+                board[end_row][end_col] = "--"
+                board[start_row][end_col] = piece_cap
+                piece_squares[piece_cap].add(start_row * 8 + end_col)
             else:
-                self.board[move.start_row][move.start_col] = move.piece_moved
-                self.board[move.end_row][move.end_col] = move.piece_cap
-
-            self.en_passant_possible = move.en_passant_possible
+                board[end_row][end_col] = piece_cap
+                if piece_cap != "--":
+                    piece_squares[piece_cap].add(end_sq)
 
-            self.castle_rights_log.pop()
-            self.current_castle_rights = self.castle_rights_log[-1]
-
-            if move.can_castle:
-                if move.end_col - move.start_col == 2:
-                    self.board[move.end_row][7] = self.board[move.end_row][5]
-                    self.board[move.end_row][5] = "--"
+            if packed & MOVE_CASTLE:
+                if end_col - start_col == 2:
+                    rook_start_col, rook_end_col = 5, 7
                 else:
-                    self.board[move.end_row][0] = self.board[move.end_row][3]
-                    self.board[move.end_row][3] = "--"
+                    rook_start_col, rook_end_col = 3, 0
+                rook = board[end_row][rook_start_col]
+                board[end_row][rook_end_col] = rook
+                board[end_row][rook_start_col] = "--"
+                rook_squares = piece_squares[rook]
+                rook_squares.remove(end_row * 8 + rook_start_col)
+                rook_squares.add(end_row * 8 + rook_end_col)
 
     """Check if a piece is pinned"""
 
@@ -141,128 +511,261 @@ class GameState:
             ally_colour = "b"
             start_row, start_col = self.black_king
 
-        directions = (
-            (-1, 0),
-            (0, -1),
-            (1, 0),
-            (0, 1),
-            (-1, -1),
-            (-1, 1),
-            (1, -1),
-            (1, 1),
-        )
-        for j, d in enumerate(directions):
+        board = self.board
+        for j, (d, ray) in enumerate(QUEEN_RAYS[start_row * 8 + start_col]):
             poss_pin = ()
-            for i in range(1, 8):
-                end_row = start_row + d[0] * i
-                end_col = start_col + d[1] * i
-
-                if 0 <= end_row < 8 and 0 <= end_col < 8:
-                    piece = self.board[end_row][end_col]
-                    if piece[0] == ally_colour:
+            for i, (end_row, end_col) in enumerate(ray, 1):
+                piece = board[end_row][end_col]
+                if piece[0] == ally_colour:
+                    if poss_pin == ():
+                        poss_pin = (end_row, end_col, d[0], d[1])
+                    else:
+                        break
+                elif piece[0] == enemy_colour:
+                    p_type = piece[1]
+
+                    if (
+                        (0 <= j <= 3 and p_type == "R")
+                        or (4 <= j <= 7 and p_type == "B")
+                        or (p_type == "Q")
+                        or (i == 1 and p_type == "K")
+                        or (
+                            i == 1
+                            and p_type == "p"
+                            and (
+                                (enemy_colour == "w" and 6 <= j <= 7)
+                                or (enemy_colour == "b" and 4 <= j <= 5)
+                            )
+                        )
+                    ):
                         if poss_pin == ():
-                            poss_pin = (end_row, end_col, d[0], d[1])
+                            in_check = True
+                            checks.append((end_row, end_col, d[0], d[1]))
                         else:
-                            break
-                    elif piece[0] == enemy_colour:
-                        p_type = piece[1]
-
-                        if (
-                            (0 <= j <= 3 and p_type == "R")
-                            or (4 <= j <= 7 and p_type == "B")
-                            or (p_type == "Q")
-                            or (i == 1 and p_type == "K")
-                            or (
-                                i == 1
-                                and p_type == "p"
-                                and (
-                                    (enemy_colour == "w" and 6 <= j <= 7)
-                                    or (enemy_colour == "b" and 4 <= j <= 5)
-                                )
-                            )
-                        ):
-                            if poss_pin == ():
-                                in_check = True
-                                checks.append((end_row, end_col, d[0], d[1]))
-                            else:
-                                pins.append(poss_pin)
-                            break
+                            pins.append(poss_pin)
+                        break
 
-                        else:
-                            break
-                else:
-                    break
+                    else:
+                        break
 
-        knight_moves = (
-            (-2, -1),
-            (-2, 1),
-            (-1, -2),
-            (-1, 2),
-            (1, -2),
-            (1, 2),
-            (2, -1),
-            (2, 1),
-        )
-        for d in knight_moves:
-            r = start_row + d[0]
-            c = start_col + d[1]
-            if 0 <= r < 8 and 0 <= c < 8:
-                piece = self.board[r][c]
-                if piece[0] == enemy_colour and piece[1] == "N":
-                    in_check = True
-                    checks.append((r, c, d[0], d[1]))
+        knight = enemy_colour + "N"
+        for r, c in KNIGHT_TARGETS[start_row * 8 + start_col]:
+            if board[r][c] == knight:
+                in_check = True
+                checks.append((r, c, r - start_row, c - start_col))
         return in_check, pins, checks
 
     """Generate valid moves with checks"""
 
-    def get_valid_moves(self):
-        move = []
+    def get_valid_moves(self, noisy=True, quiet=True):
         self.in_check, self.pins, self.checks = self.check_for_pins()
-        temp_castle_rights = CastleRights(
-            self.current_castle_rights.wks,
-            self.current_castle_rights.bks,
-            self.current_castle_rights.wqs,
-            self.current_castle_rights.bqs,
-        )
+        move = self.generate_moves(noisy, quiet)
+
+        if noisy and quiet and len(move) == 0:
+            self.checkmate = self.in_check
+            self.stalemate = not self.in_check
+
+        return move
+
+    def generate_moves(self, noisy=True, quiet=True, square=None):
+        """Legal moves for the pins and checks check_for_pins last found.
 
+        Noisy moves are captures and promotions, quiet moves everything else.
+        square limits generation to the piece standing on it.
+        """
         if self.white_to_move:
+            ally_colour = "w"
             king_row, king_col = self.white_king
         else:
+            ally_colour = "b"
             king_row, king_col = self.black_king
+        king_sq = king_row * 8 + king_col
 
-        if self.in_check:
-            if len(self.checks) == 1:
-                move = self.get_pos_moves()
-                check = self.checks[0]
-                check_row, check_col, d_row, d_col = check
-                valid_sq = [(check_row, check_col)]
-
-                for i in range(1, 8):
-                    sq = (king_row + d_row * i, king_col + d_col * i)
-                    valid_sq.append(sq)
-                    if sq == (check_row, check_col):
-                        break
-
-                move = [
-                    m
-                    for m in move
-                    if m.piece_moved[1] == "K" or (m.end_row, m.end_col) in valid_sq
-                ]
-            else:
-                move = []
-                self.get_king_moves(king_row, king_col, move)
-
+        self.gen_noisy = noisy
+        self.gen_quiet = quiet
+        move = []
+        if square is not None:
+            piece = self.board[square >> 3][square & 7]
+            if piece[0] == ally_colour and (len(self.checks) < 2 or square == king_sq):
+                self.move_func[piece[1]](square >> 3, square & 7, move)
+        elif len(self.checks) > 1:
+            self.get_king_moves(king_row, king_col, move)
         else:
             move = self.get_pos_moves()
-            self.get_castle_moves(king_row, king_col, move)
 
-        if len(move) == 0:
-            self.checkmate = self.in_check
-            self.stalemate = not self.in_check
+        if len(self.checks) == 1:
+            check_row, check_col, d_row, d_col = self.checks[0]
+            check_sq = check_row * 8 + check_col
+            valid_sq = [check_sq]
+
+            for i in range(1, 8):
+                sq = (king_row + d_row * i) * 8 + king_col + d_col * i
+                valid_sq.append(sq)
+                if sq == check_sq:
+                    break
+
+            # en passant can also remove a checking pawn from beside it
+            move = [
+                m
+                for m in move
+                if m.piece_moved[1] == "K"
+                or (m.packed >> 6 & 63) in valid_sq
+                or (m.en_passant and (m.packed & 56 | m.end_col) == check_sq)
+            ]
+        elif not self.in_check and quiet and square in (None, king_sq):
+            self.get_castle_moves(king_row, king_col, move)
 
-        self.current_castle_rights = temp_castle_rights
+        self.gen_noisy = self.gen_quiet = True
         return move
 
+    def pick_moves(self, hash_move=0, killers=(), history=None):
+        """Yield legal moves stage by stage: the hash move, captures and
+        promotions in MVV-LVA order, killers, then quiet moves.
+
+        hash_move and killers are packed moves, 0 for none. history, if
+        given, scores quiet moves by their from/to squares (packed & 4095)
+        and they come best first. Each stage is
+        only generated once the caller asks past the previous one, so a
+        cutoff on an early move skips the rest. Unlike
+        get_valid_moves this leaves checkmate/stalemate alone; a picker that
+        yields nothing means there are no legal moves.
+        """
+        # searching the children overwrites these between stages
+        pins_and_checks = self.check_for_pins()
+        seen = set()
+
+        if hash_move:
+            move = self.legal_move(hash_move, pins_and_checks)
+            if move is not None:
+                seen.add(move.packed)
+                yield move
+
+        self.in_check, self.pins, self.checks = pins_and_checks
+        noisy = self.generate_moves(quiet=False)
+        noisy.sort(key=mvv_lva, reverse=True)
+        for move in noisy:
+            if move.packed not in seen:
+                yield move
+        seen.update(move.packed for move in noisy)
+
+        for killer in killers:
+            if not killer or killer in seen:
+                continue
+            move = self.legal_move(killer, pins_and_checks)
+            if move is not None:
+                seen.add(move.packed)
+                yield move
+
+        self.in_check, self.pins, self.checks = pins_and_checks
+        quiets = self.generate_moves(noisy=False)
+        if history is not None:
+            quiets.sort(key=lambda m: history[m.packed & 4095], reverse=True)
+        for move in quiets:
+            if move.packed not in seen:
+                yield move
+
+    def get_capture_moves(self, see_filter=False):
+        """Legal captures and promotions, best MVV-LVA first.
+
+        With see_filter, captures that lose material on the exchange are
+        dropped (promotions are always kept).
+        """
+        moves = self.get_valid_moves(quiet=False)
+        if see_filter:
+            moves = [m for m in moves if m.packed & MOVE_PROMOTION or self.see(m) >= 0]
+        moves.sort(key=mvv_lva, reverse=True)
+        return moves
+
+    def see(self, move):
+        """Static exchange evaluation of a capture, in SEE_VALUES units.
+
+        Both sides keep recapturing on the target square with their least
+        valuable attacker and may stop whenever that is better. Pins are
+        ignored, as usual for SEE.
+        """
+        board = self.board
+        start_row, start_col = move.start_row, move.start_col
+        row, col = move.end_row, move.end_col
+        mover = move.piece_moved
+        lifted = [(start_row, start_col, mover), (row, col, board[row][col])]
+        if move.en_passant:
+            lifted.append((start_row, col, board[start_row][col]))
+            board[start_row][col] = "--"
+            gain = [SEE_VALUES["p"]]
+        else:
+            gain = [SEE_VALUES.get(move.piece_cap[1], 0)]
+        if move.is_pawn_promoted:
+            mover = mover[0] + "Q"
+            gain[0] += SEE_VALUES["Q"] - SEE_VALUES["p"]
+        board[start_row][start_col] = "--"
+        board[row][col] = mover
+
+        colour = "b" if mover[0] == "w" else "w"
+        while True:
+            attacker = self.least_valuable_attacker(row, col, colour)
+            if attacker is None:
+                break
+            r, c = attacker
+            gain.append(SEE_VALUES[board[row][col][1]] - gain[-1])
+            lifted.append((r, c, board[r][c]))
+            board[row][col] = board[r][c]
+            board[r][c] = "--"
+            colour = "b" if colour == "w" else "w"
+
+        for r, c, piece in reversed(lifted):
+            board[r][c] = piece
+        while len(gain) > 1:
+            last = gain.pop()
+            gain[-1] = -max(-gain[-1], last)
+        return gain[0]
+
+    def least_valuable_attacker(self, row, col, colour):
+        """(row, col) of colour's cheapest piece attacking the square, or None"""
+        board = self.board
+        pawn_row = row + 1 if colour == "w" else row - 1
+        if 0 <= pawn_row < 8:
+            for c in (col - 1, col + 1):
+                if 0 <= c < 8 and board[pawn_row][c] == colour + "p":
+                    return pawn_row, c
+
+        knight = colour + "N"
+        for r, c in KNIGHT_TARGETS[row * 8 + col]:
+            if board[r][c] == knight:
+                return r, c
+
+        # the first piece along each ray, by type
+        found = {}
+        for j, (d, ray) in enumerate(QUEEN_RAYS[row * 8 + col]):
+            slider = "R" if j < 4 else "B"
+            for i, (r, c) in enumerate(ray, 1):
+                piece = board[r][c]
+                if piece != "--":
+                    if piece[0] == colour:
+                        p_type = piece[1]
+                        if p_type == slider or p_type == "Q":
+                            found.setdefault(p_type, (r, c))
+                        elif p_type == "K" and i == 1:
+                            found["K"] = (r, c)
+                    break
+        for p_type in "BRQK":
+            if p_type in found:
+                return found[p_type]
+        return None
+
+    def legal_move(self, packed, pins_and_checks=None):
+        """The legal move with this packed encoding, if the position has one.
+
+        pins_and_checks is check_for_pins() for this position, for callers
+        that already have it; otherwise it is worked out here.
+        """
+        if pins_and_checks is None:
+            pins_and_checks = self.check_for_pins()
+        self.in_check, self.pins, self.checks = pins_and_checks
+        for move in self.generate_moves(square=packed & 63):
+            if move.packed == packed:
+                return move
+        return None
+
     """Check if the king is in check"""
 
     def check_if_in_check(self):
@@ -272,33 +775,54 @@ class GameState:
             return self.square_under_attack(self.black_king[0], self.black_king[1])
 
     def square_under_attack(self, row, col):
-        self.white_to_move = not self.white_to_move
-        temp_castle_rights = self.current_castle_rights
-        self.current_castle_rights = CastleRights(False, False, False, False)
-        op_move = self.get_pos_moves(ignore_king=True)
-        self.current_castle_rights = temp_castle_rights
-        self.white_to_move = not self.white_to_move
-        for move in op_move:
-            if move.end_row == row and move.end_col == col:
+        """Probe outward from the square for enemy attackers, without moving anything"""
+        board = self.board
+        if self.white_to_move:
+            enemy_colour = "b"
+            pawn_row = row - 1
+        else:
+            enemy_colour = "w"
+            pawn_row = row + 1
+
+        if 0 <= pawn_row < 8:
+            pawn = enemy_colour + "p"
+            if col - 1 >= 0 and board[pawn_row][col - 1] == pawn:
                 return True
+            if col + 1 <= 7 and board[pawn_row][col + 1] == pawn:
+                return True
+
+        knight = enemy_colour + "N"
+        for r, c in KNIGHT_TARGETS[row * 8 + col]:
+            if board[r][c] == knight:
+                return True
+
+        # rook-like directions first, then bishop-like ones
+        for j, (d, ray) in enumerate(QUEEN_RAYS[row * 8 + col]):
+            slider = "R" if j < 4 else "B"
+            for i, (r, c) in enumerate(ray, 1):
+                piece = board[r][c]
+                if piece != "--":
+                    if piece[0] == enemy_colour:
+                        p_type = piece[1]
+                        if p_type == slider or p_type == "Q":
+                            return True
+                        if i == 1 and p_type == "K":
+                            return True
+                    break
         return False
 
     """Generate moves without checks"""
 
     def get_pos_moves(self, ignore_king=False):
         moves = []
-        for row in range(len(self.board)):
-            for col in range(len(self.board[row])):
-                piece_str = self.board[row][col]
-                if piece_str != "--":
-                    turn = piece_str[0]
-                    if (turn == "w" and self.white_to_move) or (
-                        turn == "b" and not self.white_to_move
-                    ):
-                        if ignore_king and piece_str[1] == "K":
-                            continue
-                        piece = piece_str[1]
-                        self.move_func[piece](row, col, moves)
+        colour = "w" if self.white_to_move else "b"
+        piece_squares = self.piece_squares
+        for piece in "pNBRQK":
+            if ignore_king and piece == "K":
+                continue
+            move_func = self.move_func[piece]
+            for sq in piece_squares[colour + piece]:
+                move_func(sq >> 3, sq & 7, moves)
 
         return moves
 
@@ -314,82 +838,64 @@ class GameState:
                 pin_dir = (pin[2], pin[3])
 
         if self.white_to_move:
-            if piece_pinned and pin_dir != (-1, 0) and pin_dir != (1, 0):
-                return
-            if self.board[row - 1][col] == "--":
-                moves.append(Move((row, col), (row - 1, col), self.board))
-                if row == 6 and self.board[row - 2][col] == "--":
-                    moves.append(Move((row, col), (row - 2, col), self.board))
-
-            if col - 1 >= 0:
-                if self.board[row - 1][col - 1][0] == "b":
-                    moves.append(Move((row, col), (row - 1, col - 1), self.board))
-
-            if col + 1 <= 7:
-                if self.board[row - 1][col + 1][0] == "b":
-                    moves.append(Move((row, col), (row - 1, col + 1), self.board))
-            if row == 3:
-                if col - 1 >= 0 and (row - 1, col - 1) == self.en_passant_possible:
-                    moves.append(
-                        Move(
-                            (row, col),
-                            (row - 1, col - 1),
-                            self.board,
-                            self.en_passant_possible,
-                            en_passant=True,
-                        )
-                    )
-                if col + 1 <= 7 and (row - 1, col + 1) == self.en_passant_possible:
-                    moves.append(
-                        Move(
-                            (row, col),
-                            (row - 1, col + 1),
-                            self.board,
-                            self.en_passant_possible,
-                            en_passant=True,
-                        )
-                    )
-
+            dr, home_row, enemy_colour = -1, 6, "b"
         else:
-            if piece_pinned and pin_dir != (-1, 0) and pin_dir != (1, 0):
-                return
-            if self.board[row + 1][col] == "--":
-                moves.append(Move((row, col), (row + 1, col), self.board))
-                if row == 1 and self.board[row + 2][col] == "--":
-                    moves.append(Move((row, col), (row + 2, col), self.board))
-
-            if col - 1 >= 0:
-                if self.board[row + 1][col - 1][0] == "w":
-                    moves.append(Move((row, col), (row + 1, col - 1), self.board))
-
-            if col + 1 <= 7:
-                if self.board[row + 1][col + 1][0] == "w":
-                    moves.append(Move((row, col), (row + 1, col + 1), self.board))
-            if row == 4:
-                if col - 1 >= 0 and (row + 1, col - 1) == self.en_passant_possible:
-                    moves.append(
-                        Move(
-                            (row, col),
-                            (row + 1, col - 1),
-                            self.board,
-                            self.en_passant_possible,
-                            en_passant=True,
-                        )
-                    )
-                if col + 1 <= 7 and (row + 1, col + 1) == self.en_passant_possible:
+            dr, home_row, enemy_colour = 1, 1, "w"
+        board = self.board
+        start = (row, col)
+        # a pawn never stands on the last rank, so one step ahead is on the board
+        end_row = row + dr
+        # promotions count as noisy even without a capture
+        if end_row == 0 or end_row == 7:
+            pushes = self.gen_noisy
+        else:
+            pushes = self.gen_quiet
+
+        if pushes and (not piece_pinned or pin_dir in ((dr, 0), (-dr, 0))):
+            if board[end_row][col] == "--":
+                moves.append(Move(start, (end_row, col), board))
+                if row == home_row and board[end_row + dr][col] == "--":
+                    moves.append(Move(start, (end_row + dr, col), board))
+
+        if not self.gen_noisy:
+            return
+        for dc in (-1, 1):
+            end_col = col + dc
+            if not 0 <= end_col < 8:
+                continue
+            # a diagonally pinned pawn may still capture along the pin
+            if piece_pinned and pin_dir != (dr, dc) and pin_dir != (-dr, -dc):
+                continue
+            if board[end_row][end_col][0] == enemy_colour:
+                moves.append(Move(start, (end_row, end_col), board))
+            elif (end_row, end_col) == self.en_passant_possible:
+                if not self.en_passant_exposes_king(row, col, end_col):
                     moves.append(
-                        Move(
-                            (row, col),
-                            (row + 1, col + 1),
-                            self.board,
-                            self.en_passant_possible,
-                            en_passant=True,
-                        )
+                        Move(start, (end_row, end_col), board, en_passant=True)
                     )
 
+    def en_passant_exposes_king(self, row, col, end_col):
+        """Both pawns leave the rank at once, which check_for_pins can't see"""
+        board = self.board
+        end_row = row - 1 if self.white_to_move else row + 1
+        pawn = board[row][col]
+        captured = board[row][end_col]
+        board[row][col] = "--"
+        board[row][end_col] = "--"
+        board[end_row][end_col] = pawn
+        king_row, king_col = self.white_king if self.white_to_move else self.black_king
+        exposed = self.square_under_attack(king_row, king_col)
+        board[row][col] = pawn
+        board[row][end_col] = captured
+        board[end_row][end_col] = "--"
+        return exposed
+
     """Get the piece moves with row, col and add them to the move list"""
 
     def get_rook_moves(self, row, col, moves):
+        self.get_slider_moves(row, col, ROOK_RAYS[row * 8 + col], moves)
+
+    def get_slider_moves(self, row, col, rays, moves):
         piece_pinned = False
         pin_dir = ()
 
@@ -398,99 +904,50 @@ class GameState:
                 piece_pinned = True
                 pin_dir = (pin[2], pin[3])
 
-        directions = ((-1, 0), (0, -1), (1, 0), (0, 1))
-        if self.white_to_move:
-            enemy_colour = "b"
-            ally_colour = "w"
-        else:
-            enemy_colour = "w"
-            ally_colour = "b"
-
-        for dr, dc in directions:
-            if piece_pinned and (dr, dc) != pin_dir and (-dr, -dc) != pin_dir:
+        enemy_colour = "b" if self.white_to_move else "w"
+        noisy, quiet = self.gen_noisy, self.gen_quiet
+        board = self.board
+        start = (row, col)
+        for d, ray in rays:
+            if piece_pinned and d != pin_dir and (-d[0], -d[1]) != pin_dir:
                 continue
-            for i in range(1, 8):
-                end_row = row + dr * i
-                end_col = col + dc * i
-
-                if 0 <= end_row < 8 and 0 <= end_col < 8:
-                    end_piece = self.board[end_row][end_col]
-
-                    if end_piece == "--":
-                        moves.append(Move((row, col), (end_row, end_col), self.board))
-                    elif end_piece[0] == enemy_colour:
-                        moves.append(Move((row, col), (end_row, end_col), self.board))
-                        break
-                    else:
-                        break
+            for end in ray:
+                end_piece = board[end[0]][end[1]]
+                if end_piece == "--":
+                    if quiet:
+                        moves.append(Move(start, end, board))
+                elif end_piece[0] == enemy_colour:
+                    if noisy:
+                        moves.append(Move(start, end, board))
+                    break
+                else:
+                    break
 
     def get_knight_moves(self, row, col, moves):
-        piece_pinned = False
-        pin_dir = ()
-
+        # a pinned knight can never stay on the pin line
         for pin in self.pins:
             if pin[0] == row and pin[1] == col:
-                piece_pinned = True
-                pin_dir = (pin[2], pin[3])
-        directions = (
-            (-2, -1),
-            (-2, 1),  # Up 2, left/right 1
-            (-1, -2),
-            (-1, 2),  # Up 1, left/right 2
-            (1, -2),
-            (1, 2),  # Down 1, left/right 2
-            (2, -1),
-            (2, 1),
-        )
-
-        if self.white_to_move:
-            ally_colour = "w"
-        else:
-            ally_colour = "b"
-
-        for dr, dc in directions:
-            if piece_pinned and (dr, dc) != pin_dir and (-dr, -dc) != pin_dir:
-                continue
-            end_row = row + dr
-            end_col = col + dc
+                return
 
-            if 0 <= end_row < 8 and 0 <= end_col < 8:
-                end_piece = self.board[end_row][end_col]
-                if end_piece == "--" or end_piece[0] != ally_colour:
-                    moves.append(Move((row, col), (end_row, end_col), self.board))
+        ally_colour = "w" if self.white_to_move else "b"
+        wanted = self.wanted_targets(ally_colour)
+        board = self.board
+        start = (row, col)
+        for end in KNIGHT_TARGETS[row * 8 + col]:
+            if board[end[0]][end[1]][0] in wanted:
+                moves.append(Move(start, end, board))
+
+    def wanted_targets(self, ally_colour):
+        """First letters of the squares a leaper may land on this pass"""
+        enemy_colour = "b" if ally_colour == "w" else "w"
+        if not self.gen_quiet:
+            return enemy_colour
+        if not self.gen_noisy:
+            return "-"
+        return "-" + enemy_colour
 
     def get_bishop_moves(self, row, col, moves):
-        piece_pinned = False
-        pin_dir = ()
-
-        for pin in self.pins:
-            if pin[0] == row and pin[1] == col:
-                piece_pinned = True
-                pin_dir = (pin[2], pin[3])
-        directions = ((-1, -1), (-1, 1), (1, -1), (1, 1))
-        if self.white_to_move:
-            enemy_colour = "b"
-            ally_colour = "w"
-        else:
-            enemy_colour = "w"
-            ally_colour = "b"
-
-        for dr, dc in directions:
-            if piece_pinned and (dr, dc) != pin_dir and (-dr, -dc) != pin_dir:
-                continue
-            for i in range(1, 8):
-                end_row = row + dr * i
-                end_col = col + dc * i
-
-                if 0 <= end_row < 8 and 0 <= end_col < 8:
-                    end_piece = self.board[end_row][end_col]
-                    if end_piece == "--":
-                        moves.append(Move((row, col), (end_row, end_col), self.board))
-                    elif end_piece[0] == enemy_colour:
-                        moves.append(Move((row, col), (end_row, end_col), self.board))
-                        break
-                    else:
-                        break
+        self.get_slider_moves(row, col, BISHOP_RAYS[row * 8 + col], moves)
 
     def get_queen_moves(self, row, col, moves):
         # the bishop and rook methods cover 8 directions for the queen to move
@@ -498,74 +955,31 @@ class GameState:
         self.get_rook_moves(row, col, moves)
 
     def get_king_moves(self, row, col, moves):
-        piece_pinned = False
-        pin_dir = ()
-
-        for pin in self.pins:
-            if pin[0] == row and pin[1] == col:
-                piece_pinned = True
-                pin_dir = (pin[2], pin[3])
-        directions = (
-            (-1, 0),
-            (-1, 1),
-            (0, 1),
-            (1, 1),
-            (1, 0),
-            (1, -1),
-            (0, -1),
-            (-1, -1),
-        )
         if self.white_to_move:
             ally_colour = "w"
-            enemy_colour = "b"
         else:
             ally_colour = "b"
-            enemy_colour = "w"
-        for dr, dc in directions:
-            if piece_pinned and (dr, dc) != pin_dir and (-dr, -dc) != pin_dir:
-                continue
-            end_row = row + dr
-            end_col = col + dc
-
-            if 0 <= end_row < 8 and 0 <= end_col < 8:
-                end_piece = self.board[end_row][end_col]
-                if end_piece == "--" or end_piece[0] == enemy_colour:
-                    original_piece = self.board[end_row][end_col]
-                    original_pos = (
-                        self.white_king if ally_colour == "w" else self.black_king
-                    )
-                    self.board[row][col] = "--"
-                    self.board[end_row][end_col] = ally_colour + "K"
-
-                    if ally_colour == "w":
-                        self.white_king = (end_row, end_col)
-                    else:
-                        self.black_king = (end_row, end_col)
-
-                    in_check = self.square_under_attack(end_row, end_col)
-                    self.board[row][col] = ally_colour + "K"
-                    self.board[end_row][end_col] = original_piece
-
-                    if ally_colour == "w":
-                        self.white_king = original_pos
-                    else:
-                        self.black_king = original_pos
-
-                    if not in_check:
-                        moves.append(Move((row, col), (end_row, end_col), self.board))
+        wanted = self.wanted_targets(ally_colour)
+        board = self.board
+        start = (row, col)
+        for end in KING_TARGETS[row * 8 + col]:
+            if board[end[0]][end[1]][0] in wanted:
+                # lift the king so it cannot shield the square it steps to
+                board[row][col] = "--"
+                in_check = self.square_under_attack(end[0], end[1])
+                board[row][col] = ally_colour + "K"
+
+                if not in_check:
+                    moves.append(Move(start, end, board))
 
     """Get moves for castle"""
 
     def get_castle_moves(self, row, col, move):
         if self.square_under_attack(row, col):
             return
-        if (self.white_to_move and self.current_castle_rights.wks) or (
-            not self.white_to_move and self.current_castle_rights.bks
-        ):
+        if self.castle_bits & (WKS if self.white_to_move else BKS):
             self.king_side_castle(row, col, move)
-        if (self.white_to_move and self.current_castle_rights.wqs) or (
-            not self.white_to_move and self.current_castle_rights.bqs
-        ):
+        if self.castle_bits & (WQS if self.white_to_move else BQS):
             self.queen_side_castle(row, col, move)
 
     def king_side_castle(self, row, col, move):
@@ -591,32 +1005,17 @@ class GameState:
                     Move((row, col), (row, col - 2), self.board, can_castle=True)
                 )
 
-    """Update castle rights when needed"""
-
-    def update_castle_rights(self, move):
-        if move.piece_moved == "wK":
-            self.current_castle_rights.wks = False  # pyright: ignore
-            self.current_castle_rights.wqs = False  # pyright: ignore
-        elif move.piece_moved == "bK":
-            self.current_castle_rights.bks = False  # pyright: ignore
-            self.current_castle_rights.bqs = False  # pyright: ignore
 
-        elif move.piece_moved == "wR":
-            if move.start_row == 7:
-                if move.start_col == 0:
-                    self.current_castle_rights.wqs = False  # pyright: ignore
-                elif move.start_col == 7:
-                    self.current_castle_rights.wks = False  # pyright: ignore
+class Move:
+    """A move packed into 16 bits: from square, to square and flags.
 
-        elif move.piece_moved == "bR":
-            if move.start_row == 0:
-                if move.start_col == 0:
-                    self.current_castle_rights.bqs = False
-                elif move.start_col == 7:
-                    self.current_castle_rights.bks = False
+    Squares are row * 8 + col. The legacy row/col attributes are decoded
+    from the packed int on access, so creating a Move only stores the int
+    and the two piece strings.
+    """
 
+    __slots__ = ("packed", "piece_moved", "piece_cap")
 
-class Move:
     ranksToRows = {"1": 7, "2": 6, "3": 5, "4": 4, "5": 3, "6": 2, "7": 1, "8": 0}
     rowsToRanks = {v: k for k, v in ranksToRows.items()}
     filesToCols = {"a": 0, "b": 1, "c": 2, "d": 3, "e": 4, "f": 5, "g": 6, "h": 7}
@@ -627,38 +1026,83 @@ class Move:
         started_sq,
         end_sq,
         board,
-        en_passant_possible=(),
         en_passant=False,
         can_castle=False,
     ):
-        self.start_row = started_sq[0]
-        self.start_col = started_sq[1]
-        self.end_row = end_sq[0]
-        self.end_col = end_sq[1]
-        self.piece_moved = board[self.start_row][self.start_col]
+        start_row, start_col = started_sq
+        end_row, end_col = end_sq
+        self.piece_moved = piece = board[start_row][start_col]
+        flags = 0
         if en_passant:
-            self.piece_cap = "bp" if self.piece_moved[0] == "w" else "wp"
-
+            self.piece_cap = "bp" if piece[0] == "w" else "wp"
+            flags = MOVE_EN_PASSANT
+        else:
+            self.piece_cap = board[end_row][end_col]
+        if can_castle:
+            flags |= MOVE_CASTLE
+        if piece[1] == "p" and (end_row == 0 or end_row == 7):
+            flags |= MOVE_PROMOTION
+        self.packed = (start_row * 8 + start_col) | (end_row * 8 + end_col) << 6 | flags
+
+    @classmethod
+    def from_packed(cls, packed, board):
+        """Rebuild a move, e.g. one stored in a table, against the current board"""
+        move = cls.__new__(cls)
+        move.packed = packed
+        start_sq = packed & 63
+        end_sq = packed >> 6 & 63
+        move.piece_moved = board[start_sq >> 3][start_sq & 7]
+        if packed & MOVE_EN_PASSANT:
+            move.piece_cap = "bp" if move.piece_moved[0] == "w" else "wp"
         else:
-            self.piece_cap = board[self.end_row][self.end_col]
-        self.move_id = (
+            move.piece_cap = board[end_sq >> 3][end_sq & 7]
+        return move
+
+    @property
+    def start_row(self):
+        return (self.packed & 63) >> 3
+
+    @property
+    def start_col(self):
+        return self.packed & 7
+
+    @property
+    def end_row(self):
+        return (self.packed >> 9) & 7
+
+    @property
+    def end_col(self):
+        return (self.packed >> 6) & 7
+
+    @property
+    def en_passant(self):
+        return self.packed & MOVE_EN_PASSANT != 0
+
+    @property
+    def can_castle(self):
+        return self.packed & MOVE_CASTLE != 0
+
+    @property
+    def is_pawn_promoted(self):
+        return self.packed & MOVE_PROMOTION != 0
+
+    @property
+    def move_id(self):
+        return (
             self.start_row * 1000
             + self.start_col * 100
             + self.end_row * 10
             + self.end_col
         )
-        self.is_pawn_promoted = (self.piece_moved == "wp" and self.end_row == 0) or (
-            self.piece_moved == "bp" and self.end_row == 7
-        )
-        self.en_passant = en_passant
-        self.en_passant_possible = en_passant_possible
-        self.can_castle = can_castle
 
     def __eq__(self, other):
         if isinstance(other, Move):
-            return self.move_id == other.move_id
+            return self.packed == other.packed
         return False
 
+    def __hash__(self):
+        return self.packed
+
     def getChessNotation(self):
         return self.getRankFile(self.start_row, self.start_col) + self.getRankFile(
             self.end_row, self.end_col
@@ -705,6 +1149,34 @@ class CastleRights:
         self.wqs = wqs
         self.bqs = bqs
 
+    def bits(self):
+        """Pack the rights as wks | bks << 1 | wqs << 2 | bqs << 3"""
+        return self.wks | self.bks << 1 | self.wqs << 2 | self.bqs << 3
+
+
+def mvv_lva(move):
+    """Ordering score for captures and promotions, higher first"""
+    score = 10 * MVV_LVA_VALUES[move.piece_cap[1]] - MVV_LVA_VALUES[move.piece_moved[1]]
+    if move.packed & MOVE_PROMOTION:
+        score += 10 * (MVV_LVA_VALUES["Q"] - MVV_LVA_VALUES["p"])
+    return score
+
+
+def zobrist_hash(board, white_to_move, castle_bits, en_passant_possible):
+    """Hash a position from scratch, makeMove keeps it up to date from here"""
+    key = 0
+    for row in range(8):
+        for col in range(8):
+            piece = board[row][col]
+            if piece != "--":
+                key ^= ZOBRIST_PIECES[piece][row * 8 + col]
+    if not white_to_move:
+        key ^= ZOBRIST_BLACK_TO_MOVE
+    key ^= ZOBRIST_CASTLE[castle_bits]
+    if en_passant_possible:
+        key ^= ZOBRIST_EN_PASSANT[en_passant_possible[1]]
+    return key
+
 
 def perft(gs, depth):
     if depth == 0:
@@ -721,6 +1193,74 @@ def perft(gs, depth):
     return nodes
 
 
+class PerftCache:
+    """Bounded (Zobrist key, depth) -> node count table for perft_hashed.
+
+    Entries live in flat arrays sized from size_mb, one slot per key
+    index. With policy "depth" a slot keeps whichever entry has the larger
+    depth, since deep subtrees are the expensive ones to recount, while
+    "always" lets the newest entry win.
+    """
+
+    ENTRY_BYTES = 17  # 8 byte key, 8 byte count, 1 byte depth
+
+    def __init__(self, size_mb=64, policy="depth"):
+        if policy not in ("depth", "always"):
+            raise ValueError(f"unknown replacement policy: {policy}")
+        slots = 1
+        while slots * 2 * self.ENTRY_BYTES <= size_mb * 1024 * 1024:
+            slots *= 2
+        self.mask = slots - 1
+        self.policy = policy
+        self.keys = array("Q", bytes(8 * slots))
+        self.counts = array("Q", bytes(8 * slots))
+        self.depths = array("b", bytes(slots))
+        self.probes = 0
+        self.hits = 0
+
+    def probe(self, key, depth):
+        """Return the stored count, or -1 on a miss"""
+        self.probes += 1
+        i = key & self.mask
+        if self.keys[i] == key and self.depths[i] == depth:
+            self.hits += 1
+            return self.counts[i]
+        return -1
+
+    def store(self, key, depth, nodes):
+        i = key & self.mask
+        if self.policy == "depth" and self.depths[i] > depth:
+            return
+        self.keys[i] = key
+        self.depths[i] = depth
+        self.counts[i] = nodes
+
+
+def perft_hashed(gs, depth, cache=None):
+    """perft that counts the last ply without making it and reuses transpositions"""
+    if depth == 0:
+        return 1
+    # nothing is stored for depth 1, which is counted straight off the move list
+    if cache is not None and depth >= 2:
+        nodes = cache.probe(gs.zobrist_key, depth)
+        if nodes >= 0:
+            return nodes
+
+    moves = gs.get_valid_moves()
+    if depth == 1:
+        return len(moves)
+
+    nodes = 0
+    for move in moves:
+        gs.makeMove(move)
+        nodes += perft_hashed(gs, depth - 1, cache)
+        gs.undo_move()
+
+    if cache is not None:
+        cache.store(gs.zobrist_key, depth, nodes)
+    return nodes
+
+
 def perft_divide(gs, depth):
     moves = gs.get_valid_moves()
     total = 0
@@ -734,3 +1274,66 @@ def perft_divide(gs, depth):
         total += nodes
 
     print("Total:", total)
+
+
+def _perft_subtree(state_class, snapshot, path, depth):
+    """Process pool job: replay path from the snapshot, then count below it"""
+    gs = state_class.from_snapshot(snapshot)
+    for packed in path:
+        gs.makeMove(Move.from_packed(packed, gs.board))
+    return perft(gs, depth - len(path))
+
+
+def perft_parallel(gs, depth, workers=None, split_depth=1):
+    """perft split across a process pool.
+
+    Subtrees below the first split_depth plies (1 or 2) become separate
+    jobs. Returns the total and a (move, nodes) divide list in root move
+    order, so the output does not depend on which worker finishes first.
+    """
+    if depth < split_depth or depth < 1:
+        return perft(gs, depth), []
+
+    root_moves = gs.get_valid_moves()
+    paths = []
+    owners = []
+    for i, move in enumerate(root_moves):
+        if split_depth == 1:
+            paths.append((move.packed,))
+            owners.append(i)
+            continue
+        gs.makeMove(move)
+        for reply in gs.get_valid_moves():
+            paths.append((move.packed, reply.packed))
+            owners.append(i)
+        gs.undo_move()
+
+    snapshot = gs.snapshot()
+    state_class = type(gs)
+    workers = workers or os.cpu_count() or 1
+    counts = [0] * len(root_moves)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(
+            _perft_subtree,
+            [state_class] * len(paths),
+            [snapshot] * len(paths),
+            paths,
+            [depth] * len(paths),
+            chunksize=max(1, len(paths) // (4 * workers)),
+        )
+        for owner, nodes in zip(owners, results):
+            counts[owner] += nodes
+
+    return sum(counts), list(zip(root_moves, counts))
+
+
+def perft_divide_parallel(gs, depth, workers=None, split_depth=1):
+    start = time.perf_counter()
+    total, divide = perft_parallel(gs, depth, workers, split_depth)
+    elapsed = time.perf_counter() - start
+
+    for move, nodes in divide:
+        print(move.getChessNotation(), nodes)
+    print("Total:", total)
+    print(f"Time: {elapsed:.2f}s  Nodes/second: {total / max(elapsed, 1e-9):.0f}")
+    return total
@@ -1,6 +1,6 @@
+import multiprocessing
 import os
 import sys
-import threading
 
 import pygame as p
 
@@ -13,6 +13,10 @@ SQ_SIZE = HEIGHT // DIMENSION
 fps = 60
 IMAGES = {}
 play_again = p.Rect(620, 420, 160, 50)
+# the AI deepens until its share of the clock is used, this only caps it
+AI_MAX_DEPTH = 64
+# search the expected reply while the player is thinking
+AI_PONDER = True
 
 
 def resource_path(relative_path):
@@ -137,23 +141,44 @@ def draw_play_again(screen):
     screen.blit(text, (play_again.x + 20, play_again.y + 12))
 
 
-def ai_worker(gs_copy, result):
-    result["move"] = movefinder.find_best_move(gs_copy, depth=5)
+def start_ai_process():
+    """Run the search in its own process, talking to it over a pipe.
+
+    Also returns the shared value that cancels every search with an id up
+    to the one written to it. The process is spawned rather than forked, so
+    it never inherits SDL's threads, and should be started before p.init().
+    """
+    context = multiprocessing.get_context("spawn")
+    conn, child_conn = context.Pipe()
+    cancelled = context.Value("i", 0)
+    process = context.Process(
+        target=movefinder.search_server,
+        args=(child_conn, cancelled, AI_PONDER),
+        daemon=True,
+    )
+    process.start()
+    return conn, cancelled
 
 
 def main():
+    ai_conn, ai_cancelled = start_ai_process()
     p.init()
     window = p.display.set_mode((size))
     p.display.set_caption("PyChess")
     clock = p.time.Clock()
     # images loaded only once before the game loop
     load_images()
-    ai_thinking = False
-    ai_move_result = None
-    ai_thread = None
+    # replies to searches from an abandoned game carry an old id
+    search_id = 0
 
     while True:
+        # stop a search left over from the last game before starting anew
+        ai_cancelled.value = search_id
         gs = engine.GameState()
+        # the transposition table carries over between the AI's moves
+        ai_conn.send(("new_game",))
+        ai_thinking = False
+        game_over = False
         active_color = "w"
         black_time = white_time = 10 * 60
         last_tick = p.time.get_ticks()
@@ -263,20 +288,28 @@ def main():
             if not human_turn and not gs.checkmate and not gs.stalemate:
                 if not ai_thinking:
                     ai_thinking = True
-                    ai_move_result = {"move": None}
-                    gs_copy = gs.copy()
-                    ai_thread = threading.Thread(
-                        target=ai_worker, args=(gs_copy, ai_move_result), daemon=True
+                    search_id += 1
+                    time_left = white_time if gs.white_to_move else black_time
+                    ai_conn.send(
+                        (
+                            "search",
+                            search_id,
+                            gs.snapshot(),
+                            AI_MAX_DEPTH,
+                            movefinder.allot_time(time_left),
+                        )
                     )
-                    ai_thread.start()
-                elif ai_move_result is not None and ai_move_result["move"] is not None:
-                    ai_move = ai_move_result["move"]
-                    san = ai_move.getSAN(gs)
-                    gs.makeMove(ai_move)
-                    gs.san_log.append(san)
-                    active_color = "b" if active_color == "w" else "w"
-                    valid_moves = gs.get_valid_moves()
-                    ai_thinking = False
+                elif ai_conn.poll():
+                    _, reply_id, packed, stats = ai_conn.recv()
+                    if reply_id == search_id and packed:
+                        ai_move = engine.Move.from_packed(packed, gs.board)
+                        san = ai_move.getSAN(gs)
+                        print(f"AI {san}: {stats}")
+                        gs.makeMove(ai_move)
+                        gs.san_log.append(san)
+                        active_color = "b" if active_color == "w" else "w"
+                        valid_moves = gs.get_valid_moves()
+                        ai_thinking = False
 
             if move_made:
                 valid_moves = gs.get_valid_moves()
@@ -303,6 +336,10 @@ def main():
             elif black_time <= 0:
                 gs.checkmate = True
                 endgame(window, "White won by timeout")
+            if (gs.checkmate or gs.stalemate) and not game_over:
+                # stops the AI's search, or its pondering on a finished game
+                game_over = True
+                ai_cancelled.value = search_id
             p.display.update()
 
 
@@ -407,8 +444,6 @@ def draw_pieces(display, board):
 
 
 if __name__ == "__main__":
+    # the frozen Windows build starts the AI process from this same exe
+    multiprocessing.freeze_support()
     main()
-    gs = engine.GameState()
-    print(engine.perft(gs, 1))
-    print(engine.perft(gs, 2))
-    print(engine.perft(gs, 3))
@@ -1,4 +1,12 @@
+import os
 import random
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import engine
+from transposition import EXACT, LOWER, UPPER, TranspositionTable
 
 
 def random_move(valid_moves):
@@ -7,66 +15,257 @@ def random_move(valid_moves):
     return random.choice(valid_moves)
 
 
-def safe_get_moves(gs):
-    old_checkmate = gs.checkmate
-    old_stalemate = gs.stalemate
-    old_in_check = gs.in_check
-
-    moves = gs.get_valid_moves()
-
-    gs.checkmate = old_checkmate
-    gs.stalemate = old_stalemate
-    gs.in_check = old_in_check
-
-    return moves
-
-
 """Depth 2 minimax"""
-piece_score = {"K": 0, "Q": 9, "R": 5, "B": 3, "N": 3, "p": 1}
+CHECKMATE = 100000
+# the clock and stop token are read once per this many nodes
+CHECK_EVERY_NODES = 1024
+# seconds kept back per move for the GUI and process overheads
+MOVE_OVERHEAD = 0.1
+# plies from the root that keep killer moves
+MAX_PLY = 128
+# history scores are halved once one passes this
+HISTORY_MAX = 1 << 20
+# root window half-width from the previous iteration's score, doubled on a fail
+ASPIRATION_WINDOW = 50
+ASPIRATION_MIN_DEPTH = 3
+# null move: searched this many plies shallower, and not below NULL_MOVE_MIN_DEPTH
+NULL_MOVE_REDUCTION = 2
+NULL_MOVE_MIN_DEPTH = 3
+# late move reductions: quiet moves after the first LMR_MIN_MOVES lose a ply
+LMR_MIN_MOVES = 3
+LMR_MIN_DEPTH = 3
+# beta cutoffs are counted by move index, the last slot taking the rest
+CUTOFF_SLOTS = 16
+# Lazy SMP helper i skips depth d when (d + phase) // size is odd, taking
+# (size, phase) from these at (i - 1) % 20, so helpers spread over depths
+SMP_SKIP_SIZE = (1, 1, 2, 2, 2, 2, 3, 3, 3, 3, 3, 3, 4, 4, 4, 4, 4, 4, 4, 4)
+SMP_SKIP_PHASE = (0, 1, 0, 1, 2, 3, 0, 1, 2, 3, 4, 5, 0, 1, 2, 3, 4, 5, 6, 7)
 
 
 def utility(gs):
-    moves = safe_get_moves(gs)
-    if len(moves) == 0:
-        if gs.in_check:
-            return -10000
-        else:
-            return 0
-
-    score = 0
-    for row in range(8):
-        for col in range(8):
-            sq = gs.board[row][col]
-            if sq == "--":
-                continue
-            value = piece_score[sq[1]]
-
-            if sq[1] in ("p", "N", "B"):
-                if 2 <= row <= 5 and 2 <= col <= 5:
-                    value += 0.2
-
-            score += value if sq[0] == "w" else -value
-
-    return score
-
-
-def ordered_moves(gs):
-    moves = safe_get_moves(gs)
-
-    def score(m):
-        if m.piece_cap == "--":
-            return 0
-        return 10 * piece_score[m.piece_cap[1]] - piece_score[m.piece_moved[1]]
-
-    moves.sort(key=score, reverse=True)
-    return moves[:12]
-
-
-def terminal(gs):
-    moves = safe_get_moves(gs)
-    if len(moves) == 0:
-        return True
-    return False
+    """Static evaluation in centipawns from white's side, kept up to date by
+    makeMove; checkmate is scored by SearchNode"""
+    return gs.material + gs.positional
+
+
+class SearchNode:
+    """Per-node context, so one move generation serves terminal detection,
+    mate/stalemate scoring and the move loop"""
+
+    def __init__(self, gs, hash_move=0, killers=(), history=None):
+        self.picker = gs.pick_moves(hash_move, killers, history)
+        # pulling the first move runs check_for_pins and proves one is legal
+        self.first = next(self.picker, None)
+        self.in_check = gs.in_check
+        self.terminal = self.first is None
+
+    def moves(self):
+        if self.first is not None:
+            yield self.first
+            yield from self.picker
+
+    def score(self):
+        """Side to move's score when there are no legal moves"""
+        return -CHECKMATE if self.in_check else 0
+
+
+class SearchStopped(Exception):
+    """Raised inside the search to unwind it once its time is up or its
+    stop token fires"""
+
+
+class CancelToken:
+    """Stop token for one search of search_server. cancelled is a shared
+    multiprocessing.Value holding the id of the newest search given up on,
+    so one write cancels that search and any still queued behind it."""
+
+    def __init__(self, cancelled, search_id):
+        self.cancelled = cancelled
+        self.search_id = search_id
+
+    def is_set(self):
+        return self.cancelled.value >= self.search_id
+
+
+class ConnectionToken:
+    """Stop token that fires once a message is waiting on a multiprocessing
+    connection, so a ponder search gives way to whatever the GUI sends"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def is_set(self):
+        return self.conn.poll()
+
+
+class AnyToken:
+    """Stop token that fires as soon as any of tokens does"""
+
+    def __init__(self, *tokens):
+        self.tokens = tokens
+
+    def is_set(self):
+        return any(token.is_set() for token in self.tokens)
+
+
+class SearchStats:
+    """What one find_best_move did: node counts, depths, table use, where
+    in the move lists the cutoffs came from and how long each depth took"""
+
+    def __init__(self):
+        self.nodes = 0
+        # quiescence nodes, also counted in nodes
+        self.qnodes = 0
+        self.depth = 0
+        # furthest ply from the root reached, quiescence included
+        self.seldepth = 0
+        self.score = 0
+        self.seconds = 0.0
+        self.tt_probes = 0
+        self.tt_hits = 0
+        self.cutoffs = [0] * CUTOFF_SLOTS
+        self.null_move_tries = 0
+        self.null_move_cutoffs = 0
+        self.lmr_reductions = 0
+        self.lmr_researches = 0
+        # (depth, score, nodes, seconds since the start) per finished depth
+        self.iterations = []
+
+    def update(self, state, seconds):
+        """Copy the running counts off state"""
+        self.nodes = state.nodes
+        self.qnodes = state.qnodes
+        self.seldepth = state.seldepth
+        self.seconds = seconds
+        self.tt_probes = state.tt.probes
+        self.tt_hits = state.tt.hits
+        self.cutoffs = list(state.cutoffs)
+        self.null_move_tries = state.null_move_tries
+        self.null_move_cutoffs = state.null_move_cutoffs
+        self.lmr_reductions = state.lmr_reductions
+        self.lmr_researches = state.lmr_researches
+
+    def nps(self):
+        return int(self.nodes / self.seconds) if self.seconds > 0 else 0
+
+    def first_move_cutoffs(self):
+        """Share of beta cutoffs caused by the first move searched, the usual
+        measure of move ordering"""
+        total = sum(self.cutoffs)
+        return self.cutoffs[0] / total if total else 0.0
+
+    def as_dict(self):
+        stats = dict(vars(self))
+        stats["nps"] = self.nps()
+        return stats
+
+    def __str__(self):
+        hit_rate = self.tt_hits / self.tt_probes if self.tt_probes else 0.0
+        return (
+            f"depth {self.depth}/{self.seldepth} score {self.score} "
+            f"nodes {self.nodes} ({self.qnodes} quiescence) nps {self.nps()} "
+            f"time {self.seconds:.2f}s tt hits {hit_rate:.0%} "
+            f"first-move cutoffs {self.first_move_cutoffs():.0%}"
+        )
+
+
+class SearchState:
+    """Tables shared by every node of a search, and kept between searches"""
+
+    def __init__(self, tt_size_mb=16, null_move=True, lmr=True, tt_buffer=None):
+        self.tt = TranspositionTable(tt_size_mb, tt_buffer)
+        self.null_move = null_move
+        self.lmr = lmr
+        # counts for the current search, see SearchStats
+        self.nodes = 0
+        self.qnodes = 0
+        self.seldepth = 0
+        self.cutoffs = array("I", bytes(4 * CUTOFF_SLOTS))
+        self.deadline = None
+        # anything with is_set(), e.g. a threading.Event, or None
+        self.stop = None
+        self.root_ply = 0
+        # outcome of the last find_best_move
+        self.completed_depth = 0
+        self.best_score = 0
+        # best root move so far of the depth being searched
+        self.root_move = None
+        # two quiet moves per ply that caused a beta cutoff, newest first
+        self.killers = [[0, 0] for _ in range(MAX_PLY)]
+        # butterfly tables indexed by packed & 4095, black's then white's
+        self.history = (array("i", bytes(4 * 4096)), array("i", bytes(4 * 4096)))
+        # how often the selective search fired, for the last search
+        self.null_move_tries = 0
+        self.null_move_cutoffs = 0
+        self.lmr_reductions = 0
+        self.lmr_researches = 0
+
+    def new_search(self, gs):
+        """Reset per-search state; history is halved rather than dropped"""
+        self.root_ply = gs.ply
+        self.nodes = 0
+        self.qnodes = 0
+        self.seldepth = 0
+        self.cutoffs = array("I", bytes(4 * CUTOFF_SLOTS))
+        self.tt.probes = 0
+        self.tt.hits = 0
+        self.null_move_tries = 0
+        self.null_move_cutoffs = 0
+        self.lmr_reductions = 0
+        self.lmr_researches = 0
+        self.killers = [[0, 0] for _ in range(MAX_PLY)]
+        for table in self.history:
+            for i, score in enumerate(table):
+                if score:
+                    table[i] = score >> 1
+
+    def record_cutoff(self, gs, move, depth):
+        """Remember a quiet move that caused a beta cutoff at this node"""
+        packed = move.packed
+        ply = gs.ply - self.root_ply
+        if ply < MAX_PLY:
+            killers = self.killers[ply]
+            if killers[0] != packed:
+                killers[1] = killers[0]
+                killers[0] = packed
+
+        table = self.history[gs.white_to_move]
+        i = packed & 4095
+        table[i] += depth * depth
+        if table[i] > HISTORY_MAX:
+            for j, score in enumerate(table):
+                table[j] = score >> 1
+
+    def move_order(self, gs):
+        """Killers and history table for the node gs is at"""
+        ply = gs.ply - self.root_ply
+        killers = tuple(self.killers[ply]) if ply < MAX_PLY else ()
+        return killers, self.history[gs.white_to_move]
+
+    def tick(self):
+        """Count a node, and stop the search if it has run out of time or
+        been told to stop"""
+        self.nodes += 1
+        if self.nodes % CHECK_EVERY_NODES == 0:
+            if self.deadline is not None and time.perf_counter() >= self.deadline:
+                raise SearchStopped
+            if self.stop is not None and self.stop.is_set():
+                raise SearchStopped
+
+
+def allot_time(remaining, increment=0, moves_to_go=30):
+    """Seconds to think about one move given the clock, in seconds.
+
+    An even share of the remaining time plus most of the increment, but
+    never more than half of what is left after MOVE_OVERHEAD.
+    """
+    budget = remaining / moves_to_go + increment * 0.8
+    return max(0.0, min(budget, (remaining - MOVE_OVERHEAD) / 2))
+
+
+def ordered_moves(gs, hash_move=0, killers=()):
+    # lazy, so a cutoff early on never generates the quiet moves
+    return gs.pick_moves(hash_move, killers)
 
 
 def minimax(gs, depth):
@@ -106,11 +305,14 @@ def minimax(gs, depth):
 
 
 def min_value(gs, depth, alpha, beta):
-    if terminal(gs) or depth == 0:
+    node = SearchNode(gs)
+    if node.terminal:
+        return -node.score()
+    if depth == 0:
         return utility(gs)
 
     v = float("inf")
-    for move in ordered_moves(gs):
+    for move in node.moves():
         gs.makeMove(move)
         v = min(v, max_value(gs, depth - 1, alpha, beta))
         gs.undo_move()
@@ -122,11 +324,14 @@ def min_value(gs, depth, alpha, beta):
 
 
 def max_value(gs, depth, alpha, beta):
-    if terminal(gs) or depth == 0:
+    if depth == 0:
         return quiescence(gs, alpha, beta)
+    node = SearchNode(gs)
+    if node.terminal:
+        return node.score()
 
     v = float("-inf")
-    for move in ordered_moves(gs):
+    for move in node.moves():
         gs.makeMove(move)
         v = max(v, min_value(gs, depth - 1, alpha, beta))
         gs.undo_move()
@@ -137,58 +342,427 @@ def max_value(gs, depth, alpha, beta):
     return v
 
 
-def negamax(gs, depth, alpha, beta, color):
-    if depth == 0 or terminal(gs):
-        return utility(gs)
+def has_pieces(gs):
+    """Whether the side to move has anything besides pawns and king, as
+    zugzwang is too common to trust a null move without"""
+    colour = "w" if gs.white_to_move else "b"
+    squares = gs.piece_squares
+    return any(squares[colour + piece] for piece in "NBRQ")
+
+
+def negamax(gs, depth, alpha, beta, color, state=None, null_ok=True):
+    if depth == 0:
+        return quiescence(gs, alpha, beta, state)
+
+    alpha_orig = alpha
+    hash_move = 0
+    if state is not None:
+        state.tick()
+        entry = state.tt.probe(gs.zobrist_key)
+        if entry is not None:
+            tt_depth, bound, score, hash_move = entry
+            if tt_depth >= depth:
+                if bound == EXACT:
+                    return score
+                if bound == LOWER and score >= beta:
+                    return score
+                if bound == UPPER and score <= alpha:
+                    return score
+
+        # if passing still fails high, a real move surely would
+        if (
+            state.null_move
+            and null_ok
+            and depth >= NULL_MOVE_MIN_DEPTH
+            and beta - alpha == 1
+            and beta < CHECKMATE
+            and not gs.check_if_in_check()
+            and has_pieces(gs)
+        ):
+            state.null_move_tries += 1
+            gs.make_null_move()
+            score = -negamax(
+                gs,
+                depth - 1 - NULL_MOVE_REDUCTION,
+                -beta,
+                -beta + 1,
+                -color,
+                state,
+                False,
+            )
+            gs.undo_move()
+            if score >= beta:
+                state.null_move_cutoffs += 1
+                return beta
+
+    if state is not None:
+        node = SearchNode(gs, hash_move, *state.move_order(gs))
+    else:
+        node = SearchNode(gs)
+    if node.terminal:
+        return node.score()
 
     max_eval = float("-inf")
+    best_move = 0
 
-    for move in ordered_moves(gs):
+    for i, move in enumerate(node.moves()):
         gs.makeMove(move)
 
-        eval = -negamax(gs, depth - 1, -beta, -alpha, -color)
+        reduction = 0
+        if (
+            state is not None
+            and state.lmr
+            and i >= LMR_MIN_MOVES
+            and depth >= LMR_MIN_DEPTH
+            and not node.in_check
+            and move.piece_cap == "--"
+            and not move.is_pawn_promoted
+            and not gs.check_if_in_check()
+        ):
+            reduction = 1
+        eval = pvs_child(
+            gs, depth - 1, alpha, beta, color, state, best_move == 0, reduction
+        )
         gs.undo_move()
 
-        max_eval = max(max_eval, eval)
+        if eval > max_eval:
+            max_eval = eval
+            best_move = move.packed
         alpha = max(alpha, eval)
         if alpha >= beta:
+            if state is not None:
+                state.cutoffs[min(i, CUTOFF_SLOTS - 1)] += 1
+                if move.piece_cap == "--" and not move.is_pawn_promoted:
+                    state.record_cutoff(gs, move, depth)
             break
+
+    if state is not None:
+        if max_eval <= alpha_orig:
+            bound = UPPER
+        elif max_eval >= beta:
+            bound = LOWER
+        else:
+            bound = EXACT
+        state.tt.store(gs.zobrist_key, depth, bound, max_eval, best_move)
     return max_eval
 
 
-def find_best_move(gs, depth):
+def pvs_child(gs, depth, alpha, beta, color, state, first, reduction=0):
+    """Score a child from the parent's side: the first move with the full
+    window, the rest with a null window, re-searched only if they beat alpha.
+
+    A reduced move is tried reduction plies shallower first and only gets
+    the normal search if that beats alpha.
+    """
+    if first:
+        return -negamax(gs, depth, -beta, -alpha, -color, state)
+    if reduction:
+        state.lmr_reductions += 1
+        eval = -negamax(gs, depth - reduction, -alpha - 1, -alpha, -color, state)
+        if eval <= alpha:
+            return eval
+        state.lmr_researches += 1
+    eval = -negamax(gs, depth, -alpha - 1, -alpha, -color, state)
+    if alpha < eval < beta:
+        eval = -negamax(gs, depth, -beta, -alpha, -color, state)
+    return eval
+
+
+def find_best_move(
+    gs,
+    depth,
+    state=None,
+    time_limit=None,
+    first_depth=1,
+    stop=None,
+    progress=None,
+    skip_depths=(),
+):
+    """Search deeper one ply at a time, up to depth, until time_limit
+    seconds are up or until stop.is_set(), and return (best move found,
+    SearchStats). Depths in skip_depths are passed over, except the last.
+
+    The move is the best of the last finished depth, unless the unfinished
+    one had already found a move scoring above its window. The depth
+    reached and its score are also left on state. progress, if given, is
+    called with the stats so far after each finished depth.
+    """
+    if state is None:
+        state = SearchState()
+    start = time.perf_counter()
+    state.deadline = None if time_limit is None else start + time_limit
+    state.stop = stop
+    state.new_search(gs)
+    state.completed_depth = 0
+    root_ply = gs.ply
+    stats = SearchStats()
+
+    best_move = None
+    score = 0
+    if first_depth > 1:
+        # carrying on from an earlier search of this position, e.g. a ponder
+        entry = state.tt.probe(gs.zobrist_key)
+        if entry is not None and entry[3]:
+            best_move = gs.legal_move(entry[3])
+            score = entry[2]
+            if best_move is not None:
+                state.completed_depth = entry[0]
+                state.best_score = score
+    for current in range(first_depth, depth + 1):
+        if current in skip_depths and current < depth:
+            continue
+        state.root_move = None
+        try:
+            if current < ASPIRATION_MIN_DEPTH or abs(score) >= CHECKMATE:
+                move, score = search_root(gs, current, state)
+            else:
+                move, score = aspiration_search(gs, current, state, score)
+        except SearchStopped:
+            while gs.ply > root_ply:
+                gs.undo_move()
+            if state.root_move is not None:
+                best_move = state.root_move
+            break
+        if move is None:
+            break
+        best_move = move
+        state.completed_depth = current
+        state.best_score = score
+        elapsed = time.perf_counter() - start
+        stats.iterations.append((current, score, state.nodes, elapsed))
+        if progress is not None:
+            stats.depth, stats.score = current, score
+            stats.update(state, elapsed)
+            progress(stats)
+        if abs(score) >= CHECKMATE:
+            break
+        # another ply usually takes several times longer than the last
+        if time_limit is not None and time.perf_counter() - start > time_limit / 2:
+            break
+
+    if best_move is None:
+        # out of time before depth 1 finished, any legal move beats flagging
+        best_move = next(gs.pick_moves(), None)
+    state.deadline = None
+    state.stop = None
+    stats.depth, stats.score = state.completed_depth, state.best_score
+    stats.update(state, time.perf_counter() - start)
+    return best_move, stats
+
+
+def find_best_move_parallel(gs, depth, workers=None, time_limit=None, tt_size_mb=16):
+    """Lazy SMP: worker processes run find_best_move on the same root and
+    share one transposition table in shared memory.
+
+    Worker 0 searches every depth; the others each skip their own pattern
+    of depths (see smp_skip_depths), so at any moment the workers are
+    spread over neighbouring depths and fill the table for each other. The
+    move of the deepest finished search wins, ties going to the lower
+    worker number, and is returned with that worker's SearchStats.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    shm = shared_memory.SharedMemory(
+        create=True, size=TranspositionTable.table_bytes(tt_size_mb)
+    )
+    try:
+        snapshot = gs.snapshot()
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [
+                pool.submit(
+                    _smp_worker,
+                    shm.name,
+                    tt_size_mb,
+                    type(gs),
+                    snapshot,
+                    depth,
+                    time_limit,
+                    smp_skip_depths(index, depth),
+                )
+                for index in range(workers)
+            ]
+            results = [future.result() for future in futures]
+    finally:
+        shm.close()
+        shm.unlink()
+
+    completed_depth, packed, stats = max(results, key=lambda result: result[0])
+    if not packed:
+        return None, stats
+    return engine.Move.from_packed(packed, gs.board), stats
+
+
+def smp_skip_depths(index, depth):
+    """The depths up to depth that Lazy SMP worker index leaves out"""
+    if index == 0:
+        return frozenset()
+    size = SMP_SKIP_SIZE[(index - 1) % len(SMP_SKIP_SIZE)]
+    phase = SMP_SKIP_PHASE[(index - 1) % len(SMP_SKIP_PHASE)]
+    return frozenset(d for d in range(1, depth + 1) if (d + phase) // size % 2)
+
+
+def _smp_worker(shm_name, tt_size_mb, state_class, snapshot, depth, time_limit, skip):
+    """One Lazy SMP search, returning (depth reached, packed best move, stats)"""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    state = None
+    try:
+        state = SearchState(tt_size_mb, tt_buffer=shm.buf)
+        gs = state_class.from_snapshot(snapshot)
+        move, stats = find_best_move(gs, depth, state, time_limit, skip_depths=skip)
+        packed = move.packed if move is not None else 0
+        return state.completed_depth, packed, stats
+    finally:
+        # the table's view has to go before the block can be closed
+        if state is not None:
+            state.tt.table.release()
+        shm.close()
+
+
+def search_server(conn, cancelled=None, ponder=False, tt_size_mb=16):
+    """Answer search requests arriving on a multiprocessing connection.
+
+    Meant to run in a process of its own, so a long search never competes
+    with the GUI for the GIL. ("search", search_id, snapshot, depth,
+    time_limit) is answered with ("move", search_id, packed move or 0,
+    SearchStats),
+    ("new_game",) drops the tables and ("quit",) ends the loop. Setting
+    the shared value cancelled to a search's id or higher stops that
+    search early, see CancelToken; ids should count up from 1.
+
+    With ponder, the server goes on after each reply to search the reply
+    it expects from the opponent, until the next message arrives or the
+    search just answered is cancelled, which is how the GUI says the game
+    is over. If the next search is of that position it carries on from the
+    depth reached, otherwise it starts over, though with the table still
+    warm.
+    """
+    state = SearchState(tt_size_mb)
+    # zobrist key and depth reached of the position last pondered
+    pondered = None
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            return
+        if message[0] == "search":
+            _, search_id, snapshot, depth, time_limit = message
+            gs = engine.GameState.from_snapshot(snapshot)
+            stop = None if cancelled is None else CancelToken(cancelled, search_id)
+            first_depth = 1
+            if pondered is not None and pondered[0] == gs.zobrist_key:
+                first_depth = min(pondered[1] + 1, depth)
+            move, stats = find_best_move(
+                gs, depth, state, time_limit, first_depth, stop
+            )
+            packed = move.packed if move is not None else 0
+            conn.send(("move", search_id, packed, stats))
+            pondered = None
+            if ponder and move is not None:
+                ponder_stop = ConnectionToken(conn)
+                if stop is not None:
+                    ponder_stop = AnyToken(ponder_stop, stop)
+                pondered = ponder_search(gs, move, depth, state, ponder_stop)
+        elif message[0] == "new_game":
+            state = SearchState(tt_size_mb)
+            pondered = None
+        elif message[0] == "quit":
+            return
+
+
+def ponder_search(gs, move, depth, state, stop):
+    """Play move, then the reply the transposition table expects, and search
+    the result until the stop token fires.
+
+    Returns (zobrist key, depth reached) of the pondered position, or None
+    if there was no reply to predict.
+    """
+    gs.makeMove(move)
+    entry = state.tt.probe(gs.zobrist_key)
+    reply = gs.legal_move(entry[3]) if entry is not None and entry[3] else None
+    if reply is None:
+        return None
+    gs.makeMove(reply)
+    find_best_move(gs, depth, state, stop=stop)
+    return gs.zobrist_key, state.completed_depth
+
+
+def aspiration_search(gs, depth, state, guess):
+    """search_root in a narrow window around guess, widening whichever side
+    fails until the score lands inside"""
+    delta = ASPIRATION_WINDOW
+    alpha, beta = guess - delta, guess + delta
+    while True:
+        move, score = search_root(gs, depth, state, alpha, beta)
+        if score <= alpha:
+            alpha = score - delta
+        elif score >= beta:
+            beta = score + delta
+        else:
+            return move, score
+        delta *= 2
+        if delta > CHECKMATE:
+            alpha, beta = float("-inf"), float("inf")
+
+
+def search_root(gs, depth, state, alpha=float("-inf"), beta=float("inf")):
+    """One fixed-depth search of the root, returning (best move, score).
+
+    If the score is outside (alpha, beta) it is only a bound and the move
+    should not be trusted.
+    """
+    alpha_orig = alpha
     best_move = None
-    alpha = float("-inf")
-    beta = float("inf")
 
     color = 1 if gs.white_to_move else -1
     max_eval = float("-inf")
 
-    for move in ordered_moves(gs):
+    entry = state.tt.probe(gs.zobrist_key)
+    hash_move = entry[3] if entry is not None else 0
+    for move in SearchNode(gs, hash_move, *state.move_order(gs)).moves():
         gs.makeMove(move)
-        eval = -negamax(gs, depth - 1, -beta, -alpha, -color)
+        eval = pvs_child(gs, depth - 1, alpha, beta, color, state, best_move is None)
         gs.undo_move()
         if eval > max_eval:
             max_eval = eval
             best_move = move
+            if eval > alpha_orig:
+                # proven better than anything the window allowed for
+                state.root_move = move
         alpha = max(alpha, eval)
+        if alpha >= beta:
+            break
 
-    return best_move
-
-
-def quiescence(gs, alpha, beta):
-    stand_pat = utility(gs)
+    if best_move is not None and alpha_orig < max_eval < beta:
+        state.tt.store(gs.zobrist_key, depth, EXACT, max_eval, best_move.packed)
+    return best_move, max_eval
+
+
+def quiescence(gs, alpha, beta, state=None):
+    if state is not None:
+        state.tick()
+        state.qnodes += 1
+        ply = gs.ply - state.root_ply
+        if ply > state.seldepth:
+            state.seldepth = ply
+    if gs.check_if_in_check():
+        # no standing pat in check: search every evasion, or score the mate
+        node = SearchNode(gs)
+        if node.terminal:
+            return node.score()
+        moves = node.moves()
+    else:
+        # utility is from white's side, quiescence from the side to move's
+        stand_pat = utility(gs) if gs.white_to_move else -utility(gs)
 
-    if stand_pat >= beta:
-        return beta
-    if alpha < stand_pat:
-        alpha = stand_pat
+        if stand_pat >= beta:
+            return beta
+        if alpha < stand_pat:
+            alpha = stand_pat
+        moves = gs.get_capture_moves(see_filter=True)
 
-    for move in ordered_moves(gs):
-        if move.piece_cap == "--":
-            continue
+    for move in moves:
         gs.makeMove(move)
-        score = -quiescence(gs, -beta, -alpha)
+        score = -quiescence(gs, -beta, -alpha, state)
         gs.undo_move()
 
         if score >= beta:
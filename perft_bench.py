@@ -0,0 +1,219 @@
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+
+import bitboard
+import engine
+import movefinder
+
+"""Headless perft benchmark
+
+Runs perft over the standard test positions, checks every count against the
+known value and reports time and nodes per second for each depth:
+
+    python perft_bench.py --max-depth 4 --json results.json
+
+Afterwards a shallow search from kiwipete runs on every state class, as a
+smoke test of the search API (--search-depth 0 skips it).
+
+Counts are from the chessprogramming wiki perft tables, except where a
+comment says otherwise. The engine always promotes to a queen, so positions
+whose promotions fall inside the searched depth list the queen-only count
+instead (each promoting move counts once, not four times). Where the
+promotions are all on the last ply that is the wiki count minus three
+underpromotions per promoting move; deeper in the tree it is a recount
+with the python-chess generator, skipping underpromotions.
+"""
+
+POSITIONS = [
+    (
+        "startpos",
+        "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+        [20, 400, 8902, 197281, 4865609],
+    ),
+    (
+        "kiwipete",
+        "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+        # d4 queen-only: wiki 4085603 minus 3793 promoting moves x 3 (15172 / 4)
+        [48, 2039, 97862, 4074224],
+    ),
+    (
+        "position3",
+        "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+        [14, 191, 2812, 43238, 674624],
+    ),
+    (
+        "position4",
+        "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+        # d2 queen-only: wiki 264 minus 12 promoting moves x 3 (48 / 4)
+        [6, 228],
+    ),
+    (
+        "position4-mirrored",
+        "r2q1rk1/pP1p2pp/Q4n2/bbp1p3/Np6/1B3NBn/pPPP1PPP/R3K2R b KQ - 0 1",
+        # as position4
+        [6, 228],
+    ),
+    (
+        "position5",
+        "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+        # queen-only: d1 is wiki 44 minus dxc8's 3 underpromotions; d2 and d3
+        # (wiki 1486 and 62379) promote before the last ply, so were recounted
+        [41, 1373, 54007],
+    ),
+    (
+        "position6",
+        "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+        [46, 2079, 89890],
+    ),
+    (
+        "castle-gives-check",
+        "5k2/8/8/8/8/8/8/4K2R w K - 0 1",
+        [15, 66, 1198, 6399, 120330, 661072],
+    ),
+    (
+        "castle-rights",
+        "r3k2r/1b4bq/8/8/8/8/7B/R3K2R w KQkq - 0 1",
+        [26, 1141, 27826, 1274206],
+    ),
+    (
+        "double-check",
+        "8/8/2k5/5q2/5n2/8/5K2/8 b - - 0 1",
+        [37, 183, 6559, 23527],
+    ),
+]
+
+STATE_CLASSES = {
+    "mailbox": engine.GameState,
+    "bitboard": bitboard.BitboardGameState,
+}
+
+
+def git_revision():
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.stdout.strip()
+
+
+def count_nodes(gs, depth, mode, cache):
+    if mode == "hashed":
+        return engine.perft_hashed(gs, depth, cache)
+    if mode == "parallel":
+        return engine.perft_parallel(gs, depth)[0]
+    return engine.perft(gs, depth)
+
+
+def run_suite(state_class, max_depth, mode="plain", names=None, cache_mb=64):
+    """Run perft over POSITIONS, yielding one result dict per depth"""
+    for name, fen, expected in POSITIONS:
+        if names and name not in names:
+            continue
+        for depth, want in enumerate(expected[:max_depth], 1):
+            gs = state_class.from_fen(fen)
+            cache = engine.PerftCache(cache_mb) if mode == "hashed" else None
+            start = time.perf_counter()
+            nodes = count_nodes(gs, depth, mode, cache)
+            elapsed = time.perf_counter() - start
+            yield {
+                "position": name,
+                "depth": depth,
+                "nodes": nodes,
+                "expected": want,
+                "passed": nodes == want,
+                "seconds": round(elapsed, 4),
+                "nps": round(nodes / elapsed) if elapsed else None,
+            }
+
+
+def search_smoke(depth, fen=POSITIONS[1][1]):
+    """Search fen to depth with each state class, yielding one result dict each"""
+    for state, state_class in sorted(STATE_CLASSES.items()):
+        gs = state_class.from_fen(fen)
+        legal = {move.packed for move in gs.get_valid_moves()}
+        move, stats = movefinder.find_best_move(gs, depth)
+        yield {
+            "state": state,
+            "depth": depth,
+            "move": move.getChessNotation() if move is not None else None,
+            "passed": move is not None and move.packed in legal,
+            "nodes": stats.nodes,
+            "seconds": round(stats.seconds, 4),
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless perft benchmark")
+    parser.add_argument("--max-depth", type=int, default=3)
+    parser.add_argument("--state", choices=sorted(STATE_CLASSES), default="mailbox")
+    parser.add_argument(
+        "--mode", choices=("plain", "hashed", "parallel"), default="plain"
+    )
+    parser.add_argument("--position", action="append", dest="positions")
+    parser.add_argument("--search-depth", type=int, default=2)
+    parser.add_argument("--json", metavar="FILE", help="'-' writes to stdout")
+    args = parser.parse_args(argv)
+
+    results = []
+    quiet = args.json == "-"
+    for result in run_suite(
+        STATE_CLASSES[args.state], args.max_depth, args.mode, args.positions
+    ):
+        results.append(result)
+        if quiet:
+            continue
+        status = "ok" if result["passed"] else f"FAIL (want {result['expected']})"
+        print(
+            "{position:<20} d{depth} {nodes:>10} {seconds:>9.3f}s {nps:>9} nps".format(
+                **result
+            ),
+            status,
+        )
+
+    searches = list(search_smoke(args.search_depth)) if args.search_depth else []
+    if not quiet:
+        for search in searches:
+            line = "search {state:<12} d{depth} {move} {nodes:>10} {seconds:>9.3f}s"
+            print(line.format(**search), "ok" if search["passed"] else "FAIL")
+
+    total_nodes = sum(r["nodes"] for r in results)
+    total_seconds = sum(r["seconds"] for r in results)
+    failed = [r for r in results + searches if not r["passed"]]
+    summary = {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "state": args.state,
+        "mode": args.mode,
+        "max_depth": args.max_depth,
+        "nodes": total_nodes,
+        "seconds": round(total_seconds, 4),
+        "nps": round(total_nodes / total_seconds) if total_seconds else None,
+        "failed": len(failed),
+        "results": results,
+        "searches": searches,
+    }
+    if not quiet:
+        print(
+            f"Total: {total_nodes} nodes in {total_seconds:.3f}s, "
+            f"{summary['nps']} nps, {len(failed)} failed"
+        )
+    if args.json == "-":
+        json.dump(summary, sys.stdout, indent=2)
+        print()
+    elif args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
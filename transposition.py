@@ -0,0 +1,81 @@
+from array import array
+
+"""Bound types, telling how a stored score relates to the true value"""
+EXACT, LOWER, UPPER = 0, 1, 2
+
+# scores are stored biased into an unsigned 32-bit field
+SCORE_OFFSET = 1 << 31
+
+
+class TranspositionTable:
+    """Zobrist key -> (depth, bound, score, best move) for the search.
+
+    Each entry is two 64-bit words in one flat array: the key XORed with
+    the data word, then the data word holding score, depth, bound and
+    packed move. A probe only matches if both words come from the same
+    store, so processes sharing the table through a buffer need no lock;
+    a torn write just reads as a miss.
+
+    Buckets hold two entries. The first keeps whichever result was
+    searched deeper, since those are the expensive ones to redo, and the
+    second always takes the newest so recent positions still get stored.
+    """
+
+    ENTRY_BYTES = 16
+    BUCKET_ENTRIES = 2
+
+    def __init__(self, size_mb=16, buffer=None):
+        """buffer, if given, must be table_bytes(size_mb) long and is used in
+        place, e.g. the buf of a multiprocessing.shared_memory block"""
+        nbytes = self.table_bytes(size_mb)
+        self.mask = nbytes // (self.ENTRY_BYTES * self.BUCKET_ENTRIES) - 1
+        if buffer is None:
+            self.table = array("Q", bytes(nbytes))
+        else:
+            self.table = memoryview(buffer)[:nbytes].cast("Q")
+        self.probes = 0
+        self.hits = 0
+
+    @classmethod
+    def table_bytes(cls, size_mb):
+        """Bytes used for size_mb: the largest power-of-two bucket count that fits"""
+        bucket_bytes = cls.ENTRY_BYTES * cls.BUCKET_ENTRIES
+        buckets = 1
+        while buckets * 2 * bucket_bytes <= size_mb * 1024 * 1024:
+            buckets *= 2
+        return buckets * bucket_bytes
+
+    def probe(self, key):
+        """Return (depth, bound, score, move) stored for key, or None"""
+        self.probes += 1
+        table = self.table
+        i = (key & self.mask) << 2
+        data = table[i + 1]
+        if table[i] ^ data != key:
+            data = table[i + 3]
+            if table[i + 2] ^ data != key:
+                return None
+        self.hits += 1
+        return (
+            data >> 32 & 0xFF,
+            data >> 40 & 3,
+            (data & 0xFFFFFFFF) - SCORE_OFFSET,
+            data >> 42,
+        )
+
+    def store(self, key, depth, bound, score, move=0):
+        """Save a search result, move being the packed best move or 0"""
+        table = self.table
+        i = (key & self.mask) << 2
+        old = table[i + 1]
+        if table[i] ^ old != key and depth < (old >> 32 & 0xFF):
+            # the deeper entry stays, this one goes to the always-replace slot
+            i += 2
+            old = table[i + 1]
+        if move == 0 and table[i] ^ old == key:
+            move = old >> 42
+        data = (
+            (score + SCORE_OFFSET) | min(depth, 0xFF) << 32 | bound << 40 | move << 42
+        )
+        table[i] = key ^ data
+        table[i + 1] = data